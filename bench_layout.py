@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+import os
+import random
+import sqlite3
+import sys
+import argparse
+import tempfile
+
+from im2db import (
+    TILE_LAYOUTS, create_tiles_table, get_tile_grid, image_tiles_to_db,
+    insert_tile, iter_tile_grid
+)
+
+
+def create_synthetic_db(
+    output_file, layout, max_zoom, tile_size, tile_bytes, seed
+):
+    rand = random.Random(seed)
+    size = tile_size * 2 ** max_zoom
+
+    db = sqlite3.connect(output_file)
+    create_tiles_table(db, layout)
+
+    for z, y, x in iter_tile_grid(
+        get_tile_grid(tile_size, max_zoom, size, size), layout
+    ):
+        # Tiles compress differently so their sizes vary
+        image = rand.randbytes(
+            rand.randint(tile_bytes // 2, tile_bytes * 3 // 2)
+        )
+        insert_tile(db, z, y, x, image, layout)
+
+    db.commit()
+    db.close()
+
+    return {'tile_size': tile_size, 'max_zoom': max_zoom, 'max_width': size,
+            'max_height': size}
+
+
+def get_btree_entry_pages(db, name, is_index):
+    """Pages (as page numbers) that are read to reach each entry of a b-tree
+    in key order, including the overflow pages holding its payload."""
+    pages = {}
+    overflow = {}
+    for path, pageno, pagetype, ncell in db.execute(
+        'SELECT path, pageno, pagetype, ncell FROM dbstat WHERE name=?',
+        (name,)
+    ):
+        if pagetype == 'overflow':
+            cell_path = path.split('+')[0]
+            overflow.setdefault(cell_path, []).append(pageno)
+        else:
+            pages[path] = (pageno, pagetype, ncell)
+
+    entries = []
+
+    def walk(path, ancestors):
+        pageno, pagetype, ncell = pages[path]
+        ancestors = ancestors + [pageno]
+
+        for i in range(ncell + (pagetype == 'internal')):
+            if pagetype == 'internal':
+                walk('{}{:03x}/'.format(path, i), ancestors)
+                # Interior cells of table b-trees only hold child pointers
+                if not is_index or i == ncell:
+                    continue
+
+            cell_path = '{}{:03x}'.format(path, i)
+            entries.append(
+                set(ancestors) | set(overflow.get(cell_path, []))
+            )
+
+    walk('/', [])
+
+    return entries
+
+
+def get_tile_pages(db):
+    """Set of pages read when looking up each tile by `(z, y, x)`."""
+    sql, = db.execute(
+        "SELECT sql FROM sqlite_master WHERE type='table' AND name='tiles'"
+    ).fetchone()
+
+    if 'WITHOUT ROWID' in sql.upper():
+        keys = db.execute('SELECT z, y, x FROM tiles ORDER BY z, y, x')
+        return dict(zip(keys, get_btree_entry_pages(db, 'tiles', True)))
+
+    index, = db.execute(
+        "SELECT name FROM sqlite_master WHERE type='index' AND "
+        "tbl_name='tiles'"
+    ).fetchone()
+
+    index_pages = dict(zip(
+        db.execute('SELECT z, y, x FROM tiles ORDER BY z, y, x'),
+        get_btree_entry_pages(db, index, True)
+    ))
+    table_pages = dict(zip(
+        db.execute('SELECT z, y, x FROM tiles ORDER BY rowid'),
+        get_btree_entry_pages(db, 'tiles', False)
+    ))
+
+    return {
+        key: index_pages[key] | table_pages[key] for key in index_pages
+    }
+
+
+def count_runs(pages):
+    """Number of runs of consecutive page numbers, i.e., the number of seeks
+    needed to read all pages in order."""
+    pages = sorted(pages)
+    return sum(
+        1 for i, p in enumerate(pages) if i == 0 or pages[i - 1] != p - 1
+    )
+
+
+def bench_layout(
+    source_dir, tileset_info, im_type, max_zoom, tile_size, tile_bytes,
+    zoom, viewport_width, viewport_height, samples, seed
+):
+    if source_dir and not os.path.isdir(source_dir):
+        sys.exit('Source directory not found! ☹️')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(
+            '{:<14} {:>10} {:>14} {:>14}'.format(
+                'layout', 'file pages', 'pages/fetch', 'runs/fetch'
+            )
+        )
+
+        for layout in TILE_LAYOUTS:
+            output_file = os.path.join(tmp_dir, '{}.imtiles'.format(layout))
+
+            if source_dir:
+                # Without overviews, so only the tiles count towards the
+                # file pages
+                image_tiles_to_db(
+                    source_dir, output_file, tileset_info, im_type, False,
+                    layout, overview_sizes=()
+                )
+                db = sqlite3.connect(output_file)
+                tile_size, max_zoom, width, height = db.execute(
+                    'SELECT tile_size, max_zoom, width, height '
+                    'FROM tileset_info'
+                ).fetchone()
+                db.close()
+            else:
+                info = create_synthetic_db(
+                    output_file, layout, max_zoom, tile_size, tile_bytes, seed
+                )
+                width, height = info['max_width'], info['max_height']
+
+            db = sqlite3.connect(output_file)
+            tile_pages = get_tile_pages(db)
+            num_pages = db.execute('PRAGMA page_count').fetchone()[0]
+            db.close()
+
+            z = max_zoom if zoom is None else min(zoom, max_zoom)
+            wt, ht = get_tile_grid(tile_size, max_zoom, width, height)[z]
+            vw = min(viewport_width, wt)
+            vh = min(viewport_height, ht)
+
+            # Use the same viewports for every layout
+            rand = random.Random(seed)
+            total_pages = 0
+            total_runs = 0
+            for _ in range(samples):
+                x0 = rand.randint(0, wt - vw)
+                y0 = rand.randint(0, ht - vh)
+                pages = set()
+                for y in range(y0, y0 + vh):
+                    for x in range(x0, x0 + vw):
+                        pages |= tile_pages[(z, y, x)]
+                total_pages += len(pages)
+                total_runs += count_runs(pages)
+
+            print(
+                '{:<14} {:>10} {:>14.1f} {:>14.1f}'.format(
+                    layout,
+                    num_pages,
+                    total_pages / samples,
+                    total_runs / samples
+                )
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            'Measure the number of database pages touched per viewport fetch '
+            'for every layout of the tiles table'
+        )
+    )
+
+    parser.add_argument(
+        'dir',
+        nargs='?',
+        help=(
+            'directory of image tiles to benchmark (by default a synthetic '
+            'tile set is generated)'
+        ),
+        type=str
+    )
+
+    parser.add_argument(
+        '-i', '--info',
+        default='info.json',
+        help='name of the tile set info file',
+        type=str
+    )
+
+    parser.add_argument(
+        '-t', '--imtype',
+        default='jpg',
+        choices=['jpg', 'png', 'gif'],
+        help='image tile data type',
+        type=str
+    )
+
+    parser.add_argument(
+        '--max-zoom',
+        default=6,
+        help='max zoom level of the synthetic tile set',
+        type=int
+    )
+
+    parser.add_argument(
+        '--tile-size',
+        default=256,
+        help='tile size of the synthetic tile set',
+        type=int
+    )
+
+    parser.add_argument(
+        '--tile-bytes',
+        default=8192,
+        help='average number of bytes per tile of the synthetic tile set',
+        type=int
+    )
+
+    parser.add_argument(
+        '-z', '--zoom',
+        help='zoom level of the viewports (defaults to the max zoom)',
+        type=int
+    )
+
+    parser.add_argument(
+        '--viewport-width',
+        default=4,
+        help='viewport width in tiles',
+        type=int
+    )
+
+    parser.add_argument(
+        '--viewport-height',
+        default=3,
+        help='viewport height in tiles',
+        type=int
+    )
+
+    parser.add_argument(
+        '-n', '--samples',
+        default=1000,
+        help='number of random viewports',
+        type=int
+    )
+
+    parser.add_argument(
+        '--seed',
+        default=0,
+        help='random seed',
+        type=int
+    )
+
+    args = parser.parse_args()
+
+    bench_layout(
+        args.dir, args.info, args.imtype, args.max_zoom, args.tile_size,
+        args.tile_bytes, args.zoom, args.viewport_width, args.viewport_height,
+        args.samples, args.seed
+    )
+
+if __name__ == '__main__':
+    main()
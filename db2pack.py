@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+import os
+import mmap
+import sqlite3
+import struct
+import sys
+import argparse
+import json
+import time
+
+from im2db import (
+    OVERVIEW_SIZES, ImtilesError, add_overview_arguments, create_tiles_table,
+    get_tile_grid, get_zoom_offsets, store_meta_data, store_overviews
+)
+
+# Layout of a packed tile file:
+#
+#   magic | header length (uint32) | header (JSON) | index | tile data
+#
+# The index holds one (offset, length) entry per tile of the dense
+# `(z, y, x)` grid given by the tile set info, ordered by z, then y, then x.
+# A length of 0 marks a missing tile.
+PACK_MAGIC = b'IMPACK01'
+PACK_HEADER_LEN = struct.Struct('<I')
+PACK_INDEX_ENTRY = struct.Struct('<QI')
+
+
+class PackedTiles:
+    """Read-only, mmap-based access to a packed tile file."""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        except ValueError:
+            # An empty file can't be mapped
+            self._file.close()
+            raise ImtilesError('Not a packed tile file: {}'.format(path))
+
+        if self._mm[:len(PACK_MAGIC)] != PACK_MAGIC:
+            self.close()
+            raise ImtilesError('Not a packed tile file: {}'.format(path))
+
+        pos = len(PACK_MAGIC)
+        try:
+            (header_len,) = PACK_HEADER_LEN.unpack_from(self._mm, pos)
+            pos += PACK_HEADER_LEN.size
+
+            self.info = json.loads(
+                self._mm[pos:pos + header_len].decode('utf-8')
+            )
+        except (ValueError, struct.error):
+            # A truncated header or one that isn't valid JSON
+            self.close()
+            raise ImtilesError('Not a packed tile file: {}'.format(path))
+
+        self._index_start = pos + header_len
+
+        self.grid = get_tile_grid(
+            self.info['tile_size'],
+            self.info['max_zoom'],
+            self.info['width'],
+            self.info['height']
+        )
+        self._zoom_offsets, self.num_tiles = get_zoom_offsets(self.grid)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def get_tile(self, z, y, x):
+        if z < 0 or z >= len(self.grid):
+            return None
+
+        wt, ht = self.grid[z]
+        if y < 0 or y >= ht or x < 0 or x >= wt:
+            return None
+
+        i = self._zoom_offsets[z] + y * wt + x
+        offset, length = PACK_INDEX_ENTRY.unpack_from(
+            self._mm, self._index_start + i * PACK_INDEX_ENTRY.size
+        )
+
+        if not length:
+            return None
+
+        return self._mm[offset:offset + length]
+
+    def iter_tiles(self):
+        for z, (wt, ht) in enumerate(self.grid):
+            for y in range(ht):
+                for x in range(wt):
+                    image = self.get_tile(z, y, x)
+                    if image is not None:
+                        yield z, y, x, image
+
+
+def imtiles_to_pack(imtiles_path, output_file, verbose):
+    db = sqlite3.connect(imtiles_path)
+
+    (
+        tile_size, max_zoom, max_size, width, height, dtype
+    ) = db.execute(
+        'SELECT tile_size, max_zoom, max_size, width, height, dtype '
+        'FROM tileset_info'
+    ).fetchone()
+
+    info = {
+        'tile_size': tile_size,
+        'max_zoom': max_zoom,
+        'max_size': max_size,
+        'width': width,
+        'height': height,
+        'dtype': dtype,
+    }
+
+    grid = get_tile_grid(tile_size, max_zoom, width, height)
+    zoom_offsets, num_grid_tiles = get_zoom_offsets(grid)
+    num_tiles = 0
+
+    header = json.dumps(info).encode('utf-8')
+    index_start = len(PACK_MAGIC) + PACK_HEADER_LEN.size + len(header)
+    index = bytearray(num_grid_tiles * PACK_INDEX_ENTRY.size)
+    offset = index_start + len(index)
+
+    with open(output_file, 'wb') as f:
+        f.write(PACK_MAGIC)
+        f.write(PACK_HEADER_LEN.pack(len(header)))
+        f.write(header)
+        # Reserve the index and fill it in once all tiles are written
+        f.write(index)
+
+        for z, y, x, image in db.execute(
+            'SELECT z, y, x, image FROM tiles ORDER BY z, y, x'
+        ):
+            wt, ht = grid[z] if 0 <= z <= max_zoom else (0, 0)
+            if y < 0 or y >= ht or x < 0 or x >= wt:
+                db.close()
+                raise ImtilesError(
+                    'Tile {}.{}.{} is outside the tile set grid'
+                    .format(z, y, x)
+                )
+
+            if verbose:
+                print('Pack {}.{}.{}'.format(z, y, x))
+
+            f.write(image)
+
+            i = zoom_offsets[z] + y * wt + x
+            PACK_INDEX_ENTRY.pack_into(
+                index, i * PACK_INDEX_ENTRY.size, offset, len(image)
+            )
+            offset += len(image)
+            num_tiles += 1
+
+        f.seek(index_start)
+        f.write(index)
+
+    db.close()
+
+    return num_tiles
+
+
+def pack_to_imtiles(
+    pack_path, output_file, verbose, overview_sizes=OVERVIEW_SIZES,
+    overview_format=None
+):
+    with PackedTiles(pack_path) as packed:
+        info = packed.info
+
+        db = sqlite3.connect(output_file)
+
+        store_meta_data(
+            db, 1, -1, None, None, None,
+            info['tile_size'], info['max_zoom'], info['max_size'],
+            info['width'], info['height'], info['dtype'],
+        )
+
+        create_tiles_table(db)
+
+        query_insert_tile = 'INSERT INTO tiles VALUES (?,?,?,?)'
+        num_tiles = 0
+
+        for z, y, x, image in packed.iter_tiles():
+            if verbose:
+                print('Unpack {}.{}.{}'.format(z, y, x))
+
+            db.execute(query_insert_tile, (z, y, x, sqlite3.Binary(image)))
+            num_tiles += 1
+
+        db.commit()
+
+        # Packed tile files don't carry the overviews
+        store_overviews(db, overview_sizes, overview_format, verbose)
+        db.close()
+
+    return num_tiles
+
+
+def remove_partial_output(output_file):
+    try:
+        os.remove(output_file)
+    except OSError:
+        pass
+
+
+def pack(
+    source, output_file=None, reverse=False, overwrite=False, verbose=False,
+    overview_sizes=OVERVIEW_SIZES, overview_format=None
+):
+    """Convert an imtiles file into a packed tile file or, with `reverse`,
+    back and render the overviews of the unpacked file. Returns the output
+    file, the number of tiles, and the run time. Raises `ImtilesError` if the
+    file can't be converted."""
+    start_time = time.time()
+
+    if not os.path.isfile(source):
+        raise ImtilesError('Source file not found! ☹️')
+
+    if not output_file:
+        output_file = '{}.{}'.format(
+            os.path.splitext(source)[0], 'imtiles' if reverse else 'impack'
+        )
+
+    if os.path.isfile(output_file):
+        if overwrite:
+            try:
+                os.remove(output_file)
+            except OSError:
+                pass
+        else:
+            raise ImtilesError(
+                'Output exists already! 😬  Please check and remove it if ' +
+                'necessary.'
+            )
+
+    try:
+        if reverse:
+            num_tiles = pack_to_imtiles(
+                source, output_file, verbose, overview_sizes, overview_format
+            )
+        else:
+            num_tiles = imtiles_to_pack(source, output_file, verbose)
+    except (ValueError, KeyError, struct.error, sqlite3.DatabaseError) as e:
+        remove_partial_output(output_file)
+        raise ImtilesError('Conversion failed! 😵  {}'.format(e))
+    except ImtilesError:
+        remove_partial_output(output_file)
+        raise
+
+    return {
+        'output_file': output_file,
+        'tiles': num_tiles,
+        'seconds': time.time() - start_time,
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        'file',
+        help='imtiles file (or packed tile file with `--reverse`)',
+        type=str
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        help='name of the file to be generated',
+        type=str
+    )
+
+    parser.add_argument(
+        '-r', '--reverse',
+        default=False,
+        action='store_true',
+        help='convert a packed tile file back into an imtiles file'
+    )
+
+    parser.add_argument(
+        '-w', '--overwrite',
+        default=False,
+        action='store_true',
+        help='overwrite output if exist'
+    )
+
+    add_overview_arguments(parser)
+
+    parser.add_argument(
+        '-v', '--verbose',
+        help='increase output verbosity',
+        action='store_true'
+    )
+
+
+def run(args):
+    return pack(
+        args.file, args.output, args.reverse, args.overwrite, args.verbose,
+        args.overview_sizes, args.overview_format
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        run(args)
+    except ImtilesError as e:
+        sys.exit(str(e))
+
+if __name__ == '__main__':
+    main()
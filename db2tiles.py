@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import sys
+import argparse
+import json
+import math
+import pathlib
+import time
+
+from im2db import ImtilesError, get_tile_file_extension
+from rawtiles import get_raw_tile_file, is_raw_dtype
+
+
+def export(tileset, output=None, verbose=False):
+    """Export an imtiles file back into a directory of image tiles. Returns
+    the output directory, the number of exported tiles, and the run time.
+    Raises `ImtilesError` if the tile set is invalid."""
+    start_time = time.time()
+
+    if not os.path.isfile(tileset):
+        raise ImtilesError('Gimme an existing file! 😡')
+
+    if not output:
+        output = 'test/out'
+
+    basename = os.path.split(tileset)[1].split('.')[0]
+
+    # Connect to SQLite db
+    db = sqlite3.connect(tileset)
+
+    (
+        tile_size, max_zoom, max_width, max_height, dtype
+    ) = db.execute(
+        'SELECT tile_size, max_zoom, width, height, dtype FROM tileset_info'
+    ).fetchone()
+
+    if not tile_size:
+        raise ImtilesError('Tile size ({}) invalid!'.format(tile_size))
+    if not max_zoom and max_zoom != 0:
+        raise ImtilesError('Max zoom ({}) invalid!'.format(max_zoom))
+    if not max_height:
+        raise ImtilesError('Max height ({}) invalid!'.format(max_height))
+    if not max_width:
+        raise ImtilesError('Max width ({}) invalid!'.format(max_width))
+    if not dtype:
+        raise ImtilesError('Data type ({}) invalid!'.format(dtype))
+
+    pathlib.Path(
+        '{}/{}/tiles'.format(output, basename)
+    ).mkdir(parents=True, exist_ok=True)
+
+    file_path = os.path.join(output, basename, 'info.json')
+    with open(file_path, 'w') as f:
+        json.dump({
+            "tile_size": tile_size,
+            "max_width": max_width,
+            "max_height": max_height,
+            "max_zoom": max_zoom
+        }, f)
+
+    num_tiles = 0
+
+    for z in range(max_zoom + 1):
+        div = 2 ** (max_zoom - z)
+        wt = int(math.ceil((max_width / div) / tile_size))
+        ht = int(math.ceil((max_height / div) / tile_size))
+        for y in range(ht):
+            for x in range(wt):
+                id = '{}.{}.{}'.format(z, y, x)
+
+                sql = (
+                    'SELECT image FROM tiles '
+                    'WHERE z = :z AND y = :y AND x =:x'
+                )
+                param = {'z': z, 'y': y, 'x': x}
+                image_blob = db.execute(sql, param).fetchone()
+
+                if image_blob:
+                    image_blob = image_blob[0]
+
+                    # Raw tiles are stored compressed but read from `.npy`
+                    if is_raw_dtype(dtype):
+                        image_blob = get_raw_tile_file(image_blob)
+
+                    filename = '{}.{}'.format(
+                        id, get_tile_file_extension(dtype)
+                    )
+                    file_path = os.path.join(
+                        output, basename, 'tiles', filename
+                    )
+
+                    if verbose:
+                        print('Write {}'.format(file_path))
+
+                    with open(file_path, 'wb') as f:
+                        f.write(image_blob)
+
+                    num_tiles += 1
+
+    db.close()
+
+    return {
+        'output_dir': os.path.join(output, basename),
+        'tiles': num_tiles,
+        'seconds': time.time() - start_time,
+    }
+
+
+def export_zoom_level(
+    tileset, z=None, output_file=None, colormap='grey',
+    value_range=(None, None), verbose=False
+):
+    """Export a whole zoom level (by default the max zoom level) of an imtiles
+    file as one PNG. The PNG is rendered and compressed one row of tiles at a
+    time. Returns the output file, the size of the PNG, and the run time.
+    Raises `ImtilesError` if the tile set or zoom level is invalid."""
+    from snapshots2db import render_region_png
+
+    start_time = time.time()
+
+    if not os.path.isfile(tileset):
+        raise ImtilesError('Gimme an existing file! 😡')
+
+    db = sqlite3.connect(tileset)
+
+    tile_size, max_zoom, max_width, max_height = db.execute(
+        'SELECT tile_size, max_zoom, width, height FROM tileset_info'
+    ).fetchone()
+
+    if z is None:
+        z = max_zoom
+
+    if z < 0 or z > max_zoom:
+        db.close()
+        raise ImtilesError('Zoom level ({}) invalid!'.format(z))
+
+    if not output_file:
+        output_file = '{}.z{}.png'.format(os.path.splitext(tileset)[0], z)
+
+    div = 2 ** (max_zoom - z)
+    width = max(int(math.ceil(max_width / div)), 1)
+    height = max(int(math.ceil(max_height / div)), 1)
+
+    if verbose:
+        print(
+            'Write zoom level {} ({} x {} pixel) to {}'
+            .format(z, width, height, output_file)
+        )
+
+    with open(output_file, 'wb') as f:
+        render_region_png(
+            db, z, 0, width, 0, height, f,
+            tile_size=tile_size,
+            colormap=colormap,
+            value_range=value_range
+        )
+
+    db.close()
+
+    return {
+        'output_file': output_file,
+        'width': width,
+        'height': height,
+        'seconds': time.time() - start_time,
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "file",
+        help="image tile set file to be tested",
+        type=str
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        help='name of the sqlite database to be generated',
+        type=str
+    )
+
+    parser.add_argument(
+        '-z', '--zoom',
+        help=(
+            'export this zoom level as one PNG instead of exporting the '
+            'tiles; -1 selects the max zoom level'
+        ),
+        type=int
+    )
+
+    parser.add_argument(
+        '-v', '--verbose',
+        help='increase output verbosity',
+        action='store_true'
+    )
+
+
+def run(args):
+    if args.zoom is not None:
+        return export_zoom_level(
+            args.file, None if args.zoom < 0 else args.zoom, args.output,
+            verbose=args.verbose
+        )
+
+    return export(args.file, args.output, args.verbose)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        run(args)
+    except ImtilesError as e:
+        sys.exit(str(e))
+
+if __name__ == '__main__':
+    main()
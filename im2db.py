@@ -2,10 +2,39 @@
 
 import os
 import math
+import re
 import sqlite3
 import sys
 import argparse
 import json
+import tarfile
+import time
+import zipfile
+
+from rawtiles import RAW_DTYPES, read_raw_tile
+
+
+class ImtilesError(Exception):
+    """Raised when a tile set can't be converted."""
+
+
+ARCHIVE_EXTENSIONS = ('.tar.gz', '.tgz', '.tar', '.zip')
+
+IMAGE_TYPES = ('jpg', 'png', 'gif')
+# Raw data tiles are read from `.npy` files
+RAW_TYPES = tuple(RAW_DTYPES)
+
+# Physical layouts of the `tiles` table:
+# - raster: rowid table filled row by row
+# - without-rowid: the table is clustered by its `(z, y, x)` primary key
+# - morton: the rowid is the position of the tile along a Z-order curve so
+#   tiles close to each other in the image are close to each other on disk
+TILE_LAYOUTS = ('raster', 'without-rowid', 'morton')
+
+# Sizes (in pixels of the longer side) and formats of the whole-image
+# overviews that are precomputed at ingest time
+OVERVIEW_SIZES = (128, 256, 512)
+OVERVIEW_FORMATS = ('jpg', 'png')
 
 
 def store_meta_data(
@@ -50,24 +79,663 @@ def store_meta_data(
     pass
 
 
+def get_tile_grid(tile_size, max_zoom, width, height):
+    grid = []
+    for z in range(max_zoom + 1):
+        div = 2 ** (max_zoom - z)
+        wt = int(math.ceil((width / div) / tile_size))
+        ht = int(math.ceil((height / div) / tile_size))
+        grid.append((wt, ht))
+
+    return grid
+
+
+def get_zoom_offsets(grid):
+    offsets = []
+    num_tiles = 0
+    for wt, ht in grid:
+        offsets.append(num_tiles)
+        num_tiles += wt * ht
+
+    return offsets, num_tiles
+
+
+def parse_partition(value):
+    """Parse a partition given as `i/N`, where `0 <= i < N`."""
+    try:
+        i, n = map(int, value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'partition must be given as i/N, e.g., 0/4'
+        )
+
+    if n < 1 or i < 0 or i >= n:
+        raise argparse.ArgumentTypeError(
+            'partition i/N requires 0 <= i < N'
+        )
+
+    return i, n
+
+
+def get_partition_range(num_tiles, partition):
+    """Range of linear tile indices, i.e., the position of a tile when all
+    tiles are ordered by z, y, and x, that belong to partition `(i, N)`."""
+    i, n = partition
+    return i * num_tiles // n, (i + 1) * num_tiles // n
+
+
+def create_partition_info(db, partition, tile_range):
+    db.execute('''
+        CREATE TABLE partition_info
+        (
+            partition INT,
+            partitions INT,
+            tile_from INT,
+            tile_to INT
+        )
+        ''')
+    db.execute(
+        'INSERT INTO partition_info VALUES (?,?,?,?)',
+        partition + tile_range
+    )
+    db.commit()
+
+
+def get_partition_output_file(output_file, partition):
+    return '{}.part-{}-of-{}{}'.format(
+        os.path.splitext(output_file)[0], partition[0], partition[1],
+        os.path.splitext(output_file)[1]
+    )
+
+
+def morton_code(x, y):
+    code = 0
+    for i in range(max(x.bit_length(), y.bit_length())):
+        code |= ((x >> i) & 1) << (2 * i)
+        code |= ((y >> i) & 1) << (2 * i + 1)
+
+    return code
+
+
+def get_tile_rowid(z, y, x):
+    # Zoom level `z` has at most `4^z` tiles, so the tiles of all lower zoom
+    # levels occupy the first `(4^z - 1) / 3` rowids
+    return (4 ** z - 1) // 3 + morton_code(x, y)
+
+
+def get_tile_rowid_sql(max_zoom):
+    """SQL expression of `get_tile_rowid()` over the columns `z`, `y`, and `x`
+    for tiles up to zoom level `max_zoom`."""
+    code = ' | '.join(
+        '(((x >> {0}) & 1) << {1}) | (((y >> {0}) & 1) << {2})'.format(
+            i, 2 * i, 2 * i + 1
+        )
+        for i in range(max_zoom)
+    )
+
+    return '(((1 << (2 * z)) - 1) / 3 + ({}))'.format(code or '0')
+
+
+def iter_tile_grid(grid, layout='raster'):
+    for z, (wt, ht) in enumerate(grid):
+        tiles = ((y, x) for y in range(ht) for x in range(wt))
+
+        if layout == 'morton':
+            tiles = sorted(tiles, key=lambda t: morton_code(t[1], t[0]))
+
+        for y, x in tiles:
+            yield z, y, x
+
+
+def get_tile_file_extension(im_type):
+    return 'npy' if im_type in RAW_TYPES else im_type
+
+
+def get_tile_name_pattern(im_type):
+    return re.compile(
+        r'^(\d+)\.(\d+)\.(\d+)\.{}$'.format(
+            re.escape(get_tile_file_extension(im_type))
+        )
+    )
+
+
+def read_tile(f, im_type):
+    if im_type in RAW_TYPES:
+        return read_raw_tile(f, im_type)
+
+    return f.read()
+
+
+def create_tiles_table(db, layout='raster'):
+    db.execute(
+        '''
+        CREATE TABLE tiles
+        (
+            z INT NOT NULL,
+            y INT NOT NULL,
+            x INT NOT NULL,
+            image BLOB,
+            PRIMARY KEY (z, y, x)
+        )
+        {}
+        '''.format('WITHOUT ROWID' if layout == 'without-rowid' else ''))
+    db.commit()
+
+
+def get_insert_tiles_query(select, layout='raster', max_zoom=0):
+    """Query for inserting all tiles returned by the `select` query, which
+    has to return the columns `z`, `y`, `x`, and `image`, in one statement."""
+    if layout == 'morton':
+        return (
+            'INSERT INTO tiles (rowid, z, y, x, image) '
+            'SELECT {}, z, y, x, image FROM ({})'
+            .format(get_tile_rowid_sql(max_zoom), select)
+        )
+
+    return 'INSERT INTO tiles (z, y, x, image) {}'.format(select)
+
+
+def insert_tile(db, z, y, x, image, layout='raster', replace=False):
+    insert = 'INSERT OR REPLACE' if replace else 'INSERT'
+
+    if layout == 'morton':
+        db.execute(
+            '{} INTO tiles (rowid, z, y, x, image) VALUES (?,?,?,?,?)'
+            .format(insert),
+            (get_tile_rowid(z, y, x), z, y, x, sqlite3.Binary(image))
+        )
+    else:
+        db.execute(
+            '{} INTO tiles VALUES (?,?,?,?)'.format(insert),
+            (z, y, x, sqlite3.Binary(image))
+        )
+
+
+def repair_missing_tiles(
+    db, tile_size, grid, im_type, layout, workers=None, verbose=False
+):
+    # Imported here as `repair.py` builds on this module
+    from repair import repair_tiles
+
+    try:
+        return repair_tiles(
+            db, tile_size, grid, im_type, layout, workers=workers,
+            verbose=verbose
+        )
+    except ImtilesError:
+        db.close()
+        raise
+
+
+def store_overviews(db, sizes, format=None, verbose=False):
+    # Imported here as `overviews.py` builds on this module
+    from overviews import create_overviews
+
+    if sizes:
+        create_overviews(db, sizes, format, verbose)
+
+
+def is_tile_archive(path):
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def iter_archive_files(archive_path):
+    """Yield the path and a file object of every regular file in the archive
+    in the order they are stored. Tar archives are read as a stream."""
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for member in archive.infolist():
+                if member.is_dir():
+                    continue
+                with archive.open(member) as f:
+                    yield member.filename, f
+    else:
+        with tarfile.open(archive_path, mode='r|*') as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                yield member.name, archive.extractfile(member)
+
+
+def archive_tiles_to_db(
+    archive_path, output_file=None, tileset_info='info.json', im_type='jpg',
+    verbose=False, layout='raster', partition=None, repair=False,
+    workers=None, overview_sizes=OVERVIEW_SIZES, overview_format=None
+):
+    start_time = time.time()
+
+    if not output_file:
+        output_file = '{}.imtiles'.format(
+            re.sub(
+                '({})$'.format('|'.join(map(re.escape, ARCHIVE_EXTENSIONS))),
+                '',
+                archive_path,
+                flags=re.IGNORECASE
+            )
+        )
+
+        if partition:
+            output_file = get_partition_output_file(output_file, partition)
+
+    if os.path.isfile(output_file):
+        raise ImtilesError(
+            'Output exists already! 😬  Please check and remove it if ' +
+            'necessary.'
+        )
+
+    tile_name = get_tile_name_pattern(im_type)
+
+    db = sqlite3.connect(output_file)
+
+    def fail(message):
+        # Don't leave an output behind that blocks a rerun
+        db.close()
+        os.remove(output_file)
+        return ImtilesError(message)
+
+    def read_info(f):
+        try:
+            return json.load(f)
+        except ValueError:
+            # An empty info is reported as broken below
+            return {}
+
+    create_tiles_table(db, layout)
+
+    # The tile set info can be located anywhere in the archive so we only
+    # read it when we come across it and insert the tiles as they arrive.
+    # Once it is known, tiles outside the tile set (or partition) are
+    # skipped.
+    info = None
+    default_info = None
+    is_in_tile_set = None
+
+    def get_tile_set_filter(info):
+        grid = get_tile_grid(
+            info['tile_size'], info['max_zoom'],
+            info['max_width'], info['max_height']
+        )
+        offsets, num_tiles = get_zoom_offsets(grid)
+        tile_from, tile_to = get_partition_range(
+            num_tiles, partition or (0, 1)
+        )
+
+        def is_in_tile_set(z, y, x):
+            if z >= len(grid):
+                return False
+            wt, ht = grid[z]
+            return (
+                y < ht and x < wt and
+                tile_from <= offsets[z] + y * wt + x < tile_to
+            )
+
+        return is_in_tile_set
+
+    try:
+        for file_path, f in iter_archive_files(archive_path):
+            dir_name, file_name = os.path.split(file_path)
+
+            if file_name == tileset_info:
+                info = read_info(f)
+                if info:
+                    is_in_tile_set = get_tile_set_filter(info)
+                continue
+
+            if file_name == 'info.json':
+                default_info = read_info(f)
+                continue
+
+            match = tile_name.match(file_name)
+            if not match or os.path.basename(dir_name) != 'tiles':
+                continue
+
+            z, y, x = map(int, match.groups())
+
+            if is_in_tile_set is not None and not is_in_tile_set(z, y, x):
+                continue
+
+            if verbose:
+                print('Insert {}'.format(file_path))
+
+            insert_tile(
+                db, z, y, x, read_tile(f, im_type), layout, replace=True
+            )
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError, OSError) as e:
+        raise fail('Archive can\'t be read! 😵  {}'.format(e))
+
+    db.commit()
+
+    if info is None:
+        if default_info is None:
+            raise fail('Tile set info file not found! 😫')
+        print('Info: using default tile set info file. 🤓')
+        info = default_info
+
+    if not info:
+        raise fail('Tile set info broken! 😤')
+
+    grid = get_tile_grid(
+        info['tile_size'], info['max_zoom'],
+        info['max_width'], info['max_height']
+    )
+
+    offsets, num_tiles = get_zoom_offsets(grid)
+    tile_from, tile_to = get_partition_range(num_tiles, partition or (0, 1))
+
+    # Remove tiles that are not part of the tile set (or partition), which
+    # can only be tiles that came before the tile set info, and make sure
+    # that all the others are present
+    num_deleted = db.execute(
+        'DELETE FROM tiles WHERE z > ?', (info['max_zoom'],)
+    ).rowcount
+    for z, (wt, ht) in enumerate(grid):
+        num_deleted += db.execute(
+            '''
+            DELETE FROM tiles
+            WHERE z = ?
+            AND (y >= ? OR x >= ? OR ? + y * ? + x NOT BETWEEN ? AND ?)
+            ''',
+            (z, ht, wt, offsets[z], wt, tile_from, tile_to - 1)
+        ).rowcount
+        num_tiles = db.execute(
+            'SELECT COUNT(*) FROM tiles WHERE z = ?', (z,)
+        ).fetchone()[0]
+        num_expected = max(
+            min(offsets[z] + wt * ht, tile_to) - max(offsets[z], tile_from), 0
+        )
+        if num_tiles < num_expected and not repair:
+            raise fail(
+                'Only {} of {} tiles of zoom level {} found! 😵  '
+                'Tile set is corrupted.'.format(num_tiles, num_expected, z)
+            )
+    db.commit()
+
+    if num_deleted:
+        # Give the pages of the deleted tiles back
+        db.execute('VACUUM')
+
+    num_synthesized = 0
+    if repair:
+        try:
+            num_synthesized = repair_missing_tiles(
+                db, info['tile_size'], grid, im_type, layout, workers, verbose
+            )
+        except ImtilesError:
+            os.remove(output_file)
+            raise
+
+    if partition:
+        create_partition_info(db, partition, (tile_from, tile_to))
+
+    store_meta_data(
+        db, 1, -1, None, None, None,
+        info['tile_size'], info['max_zoom'],
+        info['tile_size'] * (2 ** info['max_zoom']),
+        info['max_width'], info['max_height'],
+        im_type,
+    )
+
+    num_tiles, num_bytes = db.execute(
+        'SELECT COUNT(*), COALESCE(SUM(LENGTH(image)), 0) FROM tiles'
+    ).fetchone()
+
+    if not partition:
+        store_overviews(db, overview_sizes, overview_format, verbose)
+
+    db.close()
+
+    return {
+        'output_file': output_file,
+        'tiles': num_tiles - num_synthesized,
+        'synthesized': num_synthesized,
+        'bytes': num_bytes,
+        'seconds': time.time() - start_time,
+    }
+
+
+def watch_tiles_to_db(
+    source_dir, output_file=None, tileset_info='info.json', im_type='jpg',
+    verbose=False, layout='raster', partition=None, interval=1.0,
+    batch_size=100, checkpoint_interval=30.0, timeout=None,
+    overview_sizes=OVERVIEW_SIZES, overview_format=None
+):
+    """Ingest image tiles while they are still being downloaded.
+
+    The `tiles` directory is polled every `interval` seconds and new tiles are
+    inserted in batches of `batch_size`. A tile is only inserted once its size
+    and modification time did not change between two polls. The database is
+    written in WAL mode and checkpointed every `checkpoint_interval` seconds,
+    so readers can query it concurrently. An existing output is resumed.
+
+    Returns once all tiles are ingested. Raises `ImtilesError` if no new tile
+    arrived for `timeout` seconds.
+    """
+    start_time = time.time()
+
+    if is_tile_archive(source_dir):
+        raise ImtilesError(
+            'Archives can\'t be watched! 😬  Please extract it or ingest it '
+            'without --watch.'
+        )
+
+    if not os.path.isdir(source_dir):
+        raise ImtilesError('Source directory not found! ☹️')
+
+    if not output_file:
+        output_file = '{}.imtiles'.format(source_dir)
+
+        if partition:
+            output_file = get_partition_output_file(output_file, partition)
+
+    tiles_dir = os.path.join(source_dir, 'tiles')
+    tile_name = get_tile_name_pattern(im_type)
+
+    db = sqlite3.connect(output_file)
+    db.execute('PRAGMA journal_mode=WAL')
+
+    tables = set(
+        name for name, in db.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'"
+        )
+    )
+
+    # Wait for the tile set info as readers need it before any tile
+    info = None
+    last_change = time.time()
+    while info is None:
+        for file_name in (tileset_info, 'info.json'):
+            file_path = os.path.join(source_dir, file_name)
+            if os.path.isfile(file_path):
+                try:
+                    with open(file_path, 'r') as f:
+                        info = json.load(f)
+                    break
+                except ValueError:
+                    # Still being written
+                    pass
+
+        if info is None:
+            if timeout is not None and time.time() - last_change > timeout:
+                db.close()
+                raise ImtilesError('Tile set info file not found! 😫')
+            time.sleep(interval)
+
+    if not info:
+        db.close()
+        raise ImtilesError('Tile set info broken! 😤')
+
+    grid = get_tile_grid(
+        info['tile_size'], info['max_zoom'],
+        info['max_width'], info['max_height']
+    )
+    offsets, num_tiles = get_zoom_offsets(grid)
+    tile_from, tile_to = get_partition_range(num_tiles, partition or (0, 1))
+
+    if 'tileset_info' not in tables:
+        store_meta_data(
+            db, 1, -1, None, None, None,
+            info['tile_size'], info['max_zoom'],
+            info['tile_size'] * (2 ** info['max_zoom']),
+            info['max_width'], info['max_height'],
+            im_type,
+        )
+
+    if 'tiles' not in tables:
+        create_tiles_table(db, layout)
+
+    if partition and 'partition_info' not in tables:
+        create_partition_info(db, partition, (tile_from, tile_to))
+
+    inserted = set(db.execute('SELECT z, y, x FROM tiles'))
+    pending = {}
+
+    num_expected = tile_to - tile_from
+    num_inserted = 0
+    num_bytes = 0
+    last_checkpoint = time.time()
+
+    try:
+        while len(inserted) < num_expected:
+            ready = []
+            # Files that are still being written. Files that disappeared
+            # since the last scan are dropped, so they don't keep the
+            # timeout from firing.
+            scanned = {}
+
+            if os.path.isdir(tiles_dir):
+                for entry in os.scandir(tiles_dir):
+                    match = tile_name.match(entry.name)
+                    if not match:
+                        continue
+
+                    z, y, x = map(int, match.groups())
+                    if (z, y, x) in inserted or z >= len(grid):
+                        continue
+
+                    wt, ht = grid[z]
+                    if (
+                        y >= ht or x >= wt or
+                        not tile_from <= offsets[z] + y * wt + x < tile_to
+                    ):
+                        continue
+
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+
+                    state = (stat.st_size, stat.st_mtime)
+                    if pending.get(entry.name) == state:
+                        ready.append((z, y, x, entry.path))
+                    else:
+                        scanned[entry.name] = state
+
+            pending = scanned
+
+            for i in range(0, len(ready), batch_size):
+                for z, y, x, file_path in ready[i:i + batch_size]:
+                    if verbose:
+                        print('Insert {}'.format(file_path))
+
+                    with open(file_path, 'rb') as f:
+                        image = read_tile(f, im_type)
+
+                    insert_tile(db, z, y, x, image, layout)
+                    inserted.add((z, y, x))
+                    num_inserted += 1
+                    num_bytes += len(image)
+
+                db.commit()
+
+            now = time.time()
+
+            if ready or pending:
+                last_change = now
+            elif timeout is not None and now - last_change > timeout:
+                raise ImtilesError(
+                    'Only {} of {} tiles found before the timeout! 😵'
+                    .format(len(inserted), num_expected)
+                )
+
+            if now - last_checkpoint > checkpoint_interval:
+                db.execute('PRAGMA wal_checkpoint(PASSIVE)')
+                last_checkpoint = now
+
+            if len(inserted) < num_expected:
+                time.sleep(interval)
+    finally:
+        db.commit()
+        db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+        if len(inserted) == num_expected:
+            if not partition:
+                store_overviews(db, overview_sizes, overview_format, verbose)
+
+            # A finished tile set is a single self-contained file again unless
+            # readers still hold the database open
+            try:
+                db.execute('PRAGMA journal_mode=DELETE')
+            except sqlite3.OperationalError:
+                pass
+
+        db.close()
+
+    return {
+        'output_file': output_file,
+        'tiles': num_inserted,
+        'bytes': num_bytes,
+        'seconds': time.time() - start_time,
+    }
+
+
 def image_tiles_to_db(
-    source_dir, output_file, tileset_info, im_type, verbose
+    source_dir, output_file=None, tileset_info='info.json', im_type='jpg',
+    verbose=False, layout='raster', partition=None, repair=False,
+    workers=None, overview_sizes=OVERVIEW_SIZES, overview_format=None
 ):
+    """Convert a directory or archive of image tiles into an imtiles file.
+
+    With `repair`, missing tiles are synthesized from neighbouring zoom levels
+    (see `repair.py`) instead of failing the build. Whole-image overviews of
+    `overview_sizes` are rendered from the coarse zoom levels once all tiles
+    are stored (see `overviews.py`), except for partial databases.
+
+    Returns the output file, the number of inserted and synthesized tiles,
+    the bytes of the inserted tiles, and the run time. Raises `ImtilesError`
+    if the tile set can't be converted.
+    """
+    if repair and partition:
+        raise ImtilesError(
+            'Partial databases can\'t be repaired! 😬  Please repair the '
+            'merged file with `repair.py`.'
+        )
+
+    if is_tile_archive(source_dir):
+        return archive_tiles_to_db(
+            source_dir, output_file, tileset_info, im_type, verbose, layout,
+            partition, repair, workers, overview_sizes, overview_format
+        )
+
+    start_time = time.time()
+
     if not os.path.isdir(source_dir):
-        sys.exit('Source directory not found! ☹️')
+        raise ImtilesError('Source directory not found! ☹️')
 
     tileset_info = os.path.join(source_dir, tileset_info)
     if not os.path.isfile(tileset_info):
         tileset_info = os.path.join(source_dir, 'info.json')
         if not os.path.isfile(tileset_info):
-            sys.exit('Tile set info file not found! 😫')
+            raise ImtilesError('Tile set info file not found! 😫')
         print('Info: using default tile set info file. 🤓')
 
     if not output_file:
         output_file = '{}.imtiles'.format(source_dir)
 
+        if partition:
+            output_file = get_partition_output_file(output_file, partition)
+
     if os.path.isfile(output_file):
-        sys.exit(
+        raise ImtilesError(
             'Output exists already! 😬  Please check and remove it if ' +
             'necessary.'
         )
@@ -77,7 +745,7 @@ def image_tiles_to_db(
         info = json.load(f)
 
     if not info:
-        sys.exit('Tile set info broken! 😤')
+        raise ImtilesError('Tile set info broken! 😤')
 
     # Create a new SQLite db
     # this script stores data in a sqlite database
@@ -91,57 +759,97 @@ def image_tiles_to_db(
         im_type,
     )
 
-    db.execute(
-        '''
-        CREATE TABLE tiles
-        (
-            z INT NOT NULL,
-            y INT NOT NULL,
-            x INT NOT NULL,
-            image BLOB,
-            PRIMARY KEY (z, y, x)
-        )
-        ''')
-    db.commit()
+    create_tiles_table(db, layout)
 
-    query_insert_tile = 'INSERT INTO tiles VALUES (?,?,?,?)'
+    grid = get_tile_grid(
+        info['tile_size'], info['max_zoom'],
+        info['max_width'], info['max_height']
+    )
 
-    for z in range(info['max_zoom'] + 1):
-        div = 2 ** (info['max_zoom'] - z)
-        wt = int(math.ceil((info['max_width'] / div) / info['tile_size']))
-        ht = int(math.ceil((info['max_height'] / div) / info['tile_size']))
-        for y in range(ht):
-            for x in range(wt):
-                tile_id = '{}.{}.{}'.format(z, y, x)
-                file_name = '{}.{}'.format(tile_id, im_type)
-                file_path = os.path.join(source_dir, 'tiles', file_name)
+    offsets, num_tiles = get_zoom_offsets(grid)
+    tile_from, tile_to = get_partition_range(num_tiles, partition or (0, 1))
 
-                if verbose:
-                    print('Insert {}'.format(file_path))
+    if partition:
+        create_partition_info(db, partition, (tile_from, tile_to))
 
-                if os.path.isfile(file_path):
-                    with open(file_path, 'rb') as f:
-                        im_blob = f.read()
-                        db.execute(
-                            query_insert_tile,
-                            (z, y, x, sqlite3.Binary(im_blob))
-                        )
-                        db.commit()
-                else:
-                    sys.exit(
-                        'Tile "{}" not found! 😵  Tile set is corrupted.'
-                        .format(file_path)
-                    )
+    num_tiles = 0
+    num_bytes = 0
+    num_synthesized = 0
+
+    for z, y, x in iter_tile_grid(grid, layout):
+        if not tile_from <= offsets[z] + y * grid[z][0] + x < tile_to:
+            continue
+
+        tile_id = '{}.{}.{}'.format(z, y, x)
+        file_name = '{}.{}'.format(tile_id, get_tile_file_extension(im_type))
+        file_path = os.path.join(source_dir, 'tiles', file_name)
+
+        if verbose:
+            print('Insert {}'.format(file_path))
+
+        if os.path.isfile(file_path):
+            with open(file_path, 'rb') as f:
+                image = read_tile(f, im_type)
+                insert_tile(db, z, y, x, image, layout)
+                db.commit()
+                num_tiles += 1
+                num_bytes += len(image)
+        elif not repair:
+            db.close()
+            raise ImtilesError(
+                'Tile "{}" not found! 😵  Tile set is corrupted.'
+                .format(file_path)
+            )
+
+    if repair:
+        num_synthesized = repair_missing_tiles(
+            db, info['tile_size'], grid, im_type, layout, workers, verbose
+        )
+
+    if not partition:
+        store_overviews(db, overview_sizes, overview_format, verbose)
 
     db.close()
 
+    return {
+        'output_file': output_file,
+        'tiles': num_tiles,
+        'synthesized': num_synthesized,
+        'bytes': num_bytes,
+        'seconds': time.time() - start_time,
+    }
 
-def main():
-    parser = argparse.ArgumentParser()
 
+def add_overview_arguments(parser):
+    parser.add_argument(
+        '--overview-sizes',
+        default=list(OVERVIEW_SIZES),
+        nargs='*',
+        help=(
+            'sizes of the precomputed whole-image overviews in pixels of the '
+            'longer side; pass no size to skip them'
+        ),
+        type=int
+    )
+
+    parser.add_argument(
+        '--overview-format',
+        choices=OVERVIEW_FORMATS,
+        help=(
+            'image format of the overviews (defaults to jpg for jpg tiles and '
+            'png otherwise)'
+        ),
+        type=str
+    )
+
+
+def add_arguments(parser):
     parser.add_argument(
         'dir',
-        help='directory of image tiles to be converted',
+        help=(
+            'directory or archive (tar, tar.gz, or zip) of image tiles to be '
+            'converted'
+        ),
         type=str
     )
 
@@ -161,22 +869,122 @@ def main():
     parser.add_argument(
         '-t', '--imtype',
         default='jpg',
-        choices=['jpg', 'png', 'gif'],
-        help='image tile data type',
+        choices=IMAGE_TYPES + RAW_TYPES,
+        help=(
+            'image tile data type; uint16 and float32 tiles are read from '
+            '`.npy` files and stored as zlib compressed arrays'
+        ),
         type=str
     )
 
+    parser.add_argument(
+        '-l', '--layout',
+        default='raster',
+        choices=TILE_LAYOUTS,
+        help='physical layout of the tiles table',
+        type=str
+    )
+
+    parser.add_argument(
+        '-p', '--partition',
+        help=(
+            'only ingest partition i of N (given as i/N with 0 <= i < N) of '
+            'the tiles into a partial database, which can be combined with '
+            '`merge.py`'
+        ),
+        type=parse_partition
+    )
+
+    parser.add_argument(
+        '--repair',
+        default=False,
+        action='store_true',
+        help=(
+            'synthesize missing tiles from their children or parent instead '
+            'of failing'
+        )
+    )
+
+    parser.add_argument(
+        '--workers',
+        help=(
+            'number of worker processes for repairing tiles (defaults to the '
+            'number of CPUs)'
+        ),
+        type=int
+    )
+
+    add_overview_arguments(parser)
+
+    parser.add_argument(
+        '--watch',
+        default=False,
+        action='store_true',
+        help=(
+            'ingest tiles while they are being downloaded; the database can '
+            'be read concurrently'
+        )
+    )
+
+    parser.add_argument(
+        '--watch-interval',
+        default=1.0,
+        help='seconds between polling the tiles directory',
+        type=float
+    )
+
+    parser.add_argument(
+        '--watch-timeout',
+        help='give up if no new tiles arrived for this many seconds',
+        type=float
+    )
+
+    parser.add_argument(
+        '--batch-size',
+        default=100,
+        help='number of tiles inserted per transaction in watch mode',
+        type=int
+    )
+
+    parser.add_argument(
+        '--checkpoint-interval',
+        default=30.0,
+        help='seconds between WAL checkpoints in watch mode',
+        type=float
+    )
+
     parser.add_argument(
         '-v', '--verbose',
         help='increase output verbosity',
         action='store_true'
     )
 
-    args = parser.parse_args()
 
-    image_tiles_to_db(
-        args.dir, args.output, args.info, args.imtype, args.verbose
+def run(args):
+    if args.watch:
+        return watch_tiles_to_db(
+            args.dir, args.output, args.info, args.imtype, args.verbose,
+            args.layout, args.partition, args.watch_interval,
+            args.batch_size, args.checkpoint_interval, args.watch_timeout,
+            args.overview_sizes, args.overview_format
+        )
+
+    return image_tiles_to_db(
+        args.dir, args.output, args.info, args.imtype, args.verbose,
+        args.layout, args.partition, args.repair, args.workers,
+        args.overview_sizes, args.overview_format
     )
 
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        run(args)
+    except ImtilesError as e:
+        sys.exit(str(e))
+
 if __name__ == '__main__':
     main()
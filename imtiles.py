@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+"""Library API and command line interface of all converters.
+
+All converters raise `ImtilesError` instead of exiting and return statistics
+of their run, so many conversions can be run in one process:
+
+    import imtiles
+
+    stats = imtiles.image_tiles_to_db('test/54825', 'test/54825.imtiles')
+    imtiles.pack('test/54825.imtiles')
+
+NumPy, Pillow, and slugid are only imported once they are needed.
+"""
+
+import argparse
+import json
+import sys
+
+import db2pack
+import db2tiles as export_cli
+import im2db
+import merge as merge_cli
+import overviews as overviews_cli
+import repair as repair_cli
+import snapshots2db
+import subset as subset_cli
+
+from db2pack import PackedTiles, pack
+from db2tiles import export, export_zoom_level
+from im2db import ImtilesError, image_tiles_to_db, watch_tiles_to_db
+from merge import merge
+from overviews import get_overview, overviews
+from repair import repair
+from snapshots2db import get_preview, get_tile_png, snapshots_to_db
+from subset import subset
+
+__all__ = [
+    'ImtilesError',
+    'PackedTiles',
+    'export',
+    'export_zoom_level',
+    'get_overview',
+    'get_preview',
+    'get_tile_png',
+    'image_tiles_to_db',
+    'merge',
+    'overviews',
+    'pack',
+    'repair',
+    'snapshots_to_db',
+    'subset',
+    'watch_tiles_to_db',
+]
+
+COMMANDS = (
+    (
+        'ingest', im2db,
+        'convert a directory or archive of image tiles into an imtiles file'
+    ),
+    (
+        'snapshots', snapshots2db,
+        'convert Gigapan snapshots into a BEDPE-like SQLite database'
+    ),
+    (
+        'pack', db2pack,
+        'convert an imtiles file into a packed tile file and back'
+    ),
+    (
+        'subset', subset_cli,
+        'extract a bounding box and zoom range into a new imtiles file'
+    ),
+    (
+        'merge', merge_cli,
+        'merge partial databases into one imtiles file'
+    ),
+    (
+        'overviews', overviews_cli,
+        'precompute whole-image overviews of an imtiles file'
+    ),
+    (
+        'repair', repair_cli,
+        'synthesize missing or corrupted tiles of an imtiles file'
+    ),
+    (
+        'export', export_cli,
+        'export an imtiles file into a directory of image tiles or a PNG'
+    ),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-s', '--stats',
+        default=False,
+        action='store_true',
+        help='print the statistics of the run as JSON'
+    )
+
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    for name, module, help in COMMANDS:
+        subparser = subparsers.add_parser(name, help=help)
+        module.add_arguments(subparser)
+        subparser.set_defaults(run=module.run)
+
+    args = parser.parse_args()
+
+    try:
+        stats = args.run(args)
+    except ImtilesError as e:
+        sys.exit(str(e))
+
+    if args.stats:
+        print(json.dumps(stats))
+
+if __name__ == '__main__':
+    main()
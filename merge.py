@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import sys
+import argparse
+import time
+
+from im2db import (
+    OVERVIEW_SIZES, TILE_LAYOUTS, ImtilesError, add_overview_arguments,
+    create_tiles_table, get_insert_tiles_query, get_partition_range,
+    get_tile_grid, get_zoom_offsets, store_meta_data, store_overviews
+)
+
+
+def read_partial(partial):
+    db = sqlite3.connect(partial)
+
+    try:
+        info = db.execute(
+            'SELECT zoom_step, max_length, assembly, chrom_names, '
+            'chrom_sizes, tile_size, max_zoom, max_size, width, height, dtype '
+            'FROM tileset_info'
+        ).fetchone()
+        partition = db.execute(
+            'SELECT partition, partitions, tile_from, tile_to '
+            'FROM partition_info'
+        ).fetchone()
+    except sqlite3.DatabaseError:
+        raise ImtilesError(
+            '"{}" is not a partial database! 😵'.format(partial)
+        )
+    finally:
+        db.close()
+
+    return info, partition
+
+
+def merge_tiles(db, partials, grid, num_tiles, layout, verbose=False):
+    """Copy the tiles of all partial databases into `db` and make sure they
+    form the complete grid. Returns the number of merged tiles."""
+    create_tiles_table(db, layout)
+
+    for partial in partials:
+        if verbose:
+            print('Merge {}'.format(partial))
+
+        db.execute('ATTACH DATABASE ? AS partial', (partial,))
+
+        try:
+            db.execute(get_insert_tiles_query(
+                'SELECT z, y, x, image FROM partial.tiles ORDER BY z, y, x',
+                layout,
+                len(grid) - 1
+            ))
+        except sqlite3.IntegrityError:
+            raise ImtilesError(
+                'Tiles of "{}" overlap with another partition! 😵'
+                .format(partial)
+            )
+
+        db.commit()
+        db.execute('DETACH DATABASE partial')
+
+    # Make sure the partitions contained every tile and nothing else
+    for z, (wt, ht) in enumerate(grid):
+        num_zoom_tiles = db.execute(
+            'SELECT COUNT(*) FROM tiles WHERE z = ? AND y < ? AND x < ?',
+            (z, ht, wt)
+        ).fetchone()[0]
+        if num_zoom_tiles < wt * ht:
+            raise ImtilesError(
+                'Only {} of {} tiles of zoom level {} found! 😵  '
+                'Tile set is incomplete.'.format(num_zoom_tiles, wt * ht, z)
+            )
+
+    num_merged = db.execute('SELECT COUNT(*) FROM tiles').fetchone()[0]
+
+    if num_merged > num_tiles:
+        raise ImtilesError(
+            'Partitions contain tiles outside the tile set! 😵'
+        )
+
+    return num_merged
+
+
+def merge(
+    output_file, partials, layout='raster', overwrite=False, verbose=False,
+    overview_sizes=OVERVIEW_SIZES, overview_format=None
+):
+    """Merge partial databases created with `im2db.py --partition` into one
+    imtiles file and render its overviews. Returns the output file, the
+    number of tiles, and the run time. Raises `ImtilesError` if the partitions
+    don't form a complete tile set."""
+    start_time = time.time()
+
+    for partial in partials:
+        if not os.path.isfile(partial):
+            raise ImtilesError(
+                'Partial database "{}" not found! ☹️'.format(partial)
+            )
+
+    if os.path.isfile(output_file):
+        if overwrite:
+            try:
+                os.remove(output_file)
+            except OSError:
+                pass
+        else:
+            raise ImtilesError(
+                'Output exists already! 😬  Please check and remove it if ' +
+                'necessary.'
+            )
+
+    infos, partitions = zip(*map(read_partial, partials))
+
+    if len(set(infos)) > 1:
+        raise ImtilesError(
+            'Partial databases are from different tile sets! 😤'
+        )
+
+    info = infos[0]
+    tile_size, max_zoom, _, width, height = info[5:10]
+    grid = get_tile_grid(tile_size, max_zoom, width, height)
+    _, num_tiles = get_zoom_offsets(grid)
+
+    # Every partition of the grid has to be present exactly once
+    num_partitions = partitions[0][1]
+    covered = sorted(partition[0] for partition in partitions)
+    if (
+        any(partition[1] != num_partitions for partition in partitions) or
+        covered != list(range(num_partitions))
+    ):
+        raise ImtilesError(
+            'Partitions {} do not cover all {} partitions exactly once! 😵'
+            .format(
+                ', '.join(
+                    '{}/{}'.format(p[0], p[1]) for p in partitions
+                ),
+                num_partitions
+            )
+        )
+
+    for partial, partition in zip(partials, partitions):
+        if tuple(partition[2:]) != get_partition_range(
+            num_tiles, partition[:2]
+        ):
+            raise ImtilesError(
+                'Tile range of "{}" does not match partition {}/{}! 😵'
+                .format(partial, partition[0], partition[1])
+            )
+
+    db = sqlite3.connect(output_file)
+
+    # Never leave an output behind that looks like a complete tile set
+    try:
+        store_meta_data(db, *info)
+        num_merged = merge_tiles(
+            db, partials, grid, num_tiles, layout, verbose
+        )
+        store_overviews(db, overview_sizes, overview_format, verbose)
+    except sqlite3.DatabaseError as e:
+        db.close()
+        os.remove(output_file)
+        raise ImtilesError('Merging failed! 😵  {}'.format(e))
+    except ImtilesError:
+        db.close()
+        os.remove(output_file)
+        raise
+
+    db.close()
+
+    return {
+        'output_file': output_file,
+        'partials': len(partials),
+        'tiles': num_merged,
+        'seconds': time.time() - start_time,
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        'output',
+        help='name of the sqlite database to be generated',
+        type=str
+    )
+
+    parser.add_argument(
+        'partials',
+        nargs='+',
+        help='partial databases created with `im2db.py --partition`',
+        type=str
+    )
+
+    parser.add_argument(
+        '-l', '--layout',
+        default='raster',
+        choices=TILE_LAYOUTS,
+        help='physical layout of the tiles table',
+        type=str
+    )
+
+    parser.add_argument(
+        '-w', '--overwrite',
+        default=False,
+        action='store_true',
+        help='overwrite output if exist'
+    )
+
+    add_overview_arguments(parser)
+
+    parser.add_argument(
+        '-v', '--verbose',
+        help='increase output verbosity',
+        action='store_true'
+    )
+
+
+def run(args):
+    return merge(
+        args.output, args.partials, args.layout, args.overwrite, args.verbose,
+        args.overview_sizes, args.overview_format
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        run(args)
+    except ImtilesError as e:
+        sys.exit(str(e))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import sys
+import argparse
+import time
+
+from io import BytesIO
+from im2db import OVERVIEW_FORMATS, OVERVIEW_SIZES, ImtilesError
+from rawtiles import get_colormap_lut, is_raw_dtype
+
+# NumPy and Pillow are imported by the functions that need them, like in
+# `snapshots2db.py`.
+
+# Formats of Pillow to encode the overviews in
+PIL_FORMATS = {
+    'jpg': 'JPEG',
+    'png': 'PNG',
+}
+
+
+def get_default_overview_format(dtype):
+    return 'jpg' if dtype == 'jpg' else 'png'
+
+
+def render_zoom_level(db, z, tile_size, width, height, dtype):
+    """Stitch all tiles of zoom level `z` into one image that is cut off at
+    the extent (`width` x `height`) of the image at this zoom level."""
+    from PIL import Image
+    from snapshots2db import render_raw_tile
+
+    lut = get_colormap_lut() if is_raw_dtype(dtype) else None
+
+    im = Image.new(
+        'RGB' if lut is None else 'RGBA',
+        (width, height),
+        (255, 255, 255) if lut is None else (255, 255, 255, 0)
+    )
+
+    for y, x, image in db.execute(
+        'SELECT y, x, image FROM tiles WHERE z = ?', (z,)
+    ):
+        if lut is None:
+            tile = Image.open(BytesIO(image)).convert('RGB')
+        else:
+            tile = render_raw_tile(image, lut)
+
+        im.paste(tile, (x * tile_size, y * tile_size))
+
+    return im
+
+
+def create_overviews(db, sizes=OVERVIEW_SIZES, format=None, verbose=False):
+    """Render whole-image overviews of the given sizes from the coarsest zoom
+    level that is at least as large and store them in the `overviews` table.
+    Returns the number of stored overviews."""
+    from PIL import Image
+
+    tile_size, max_zoom, width, height, dtype = db.execute(
+        'SELECT tile_size, max_zoom, width, height, dtype FROM tileset_info'
+    ).fetchone()
+
+    format = format or get_default_overview_format(dtype)
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS overviews
+        (
+            size INT NOT NULL,
+            format TEXT NOT NULL,
+            image BLOB,
+            PRIMARY KEY (size, format)
+        )
+        ''')
+
+    rendered = {}
+
+    for size in sorted(set(sizes)):
+        z = max_zoom
+        for zoom_level in range(max_zoom + 1):
+            div = 2 ** (max_zoom - zoom_level)
+            if max(width, height) / div >= size:
+                z = zoom_level
+                break
+
+        if z not in rendered:
+            div = 2 ** (max_zoom - z)
+            rendered[z] = render_zoom_level(
+                db, z, tile_size,
+                max(int(round(width / div)), 1),
+                max(int(round(height / div)), 1),
+                dtype
+            )
+
+        im = rendered[z]
+
+        # Overviews are never scaled up
+        scale = min(size / max(im.size), 1)
+        im = im.resize(
+            (
+                max(int(round(im.size[0] * scale)), 1),
+                max(int(round(im.size[1] * scale)), 1)
+            ),
+            Image.LANCZOS
+        )
+
+        if format == 'jpg' and im.mode != 'RGB':
+            im = im.convert('RGB')
+
+        buf = BytesIO()
+        im.save(buf, format=PIL_FORMATS[format])
+
+        if verbose:
+            print(
+                'Store {}px {} overview rendered from zoom level {}'
+                .format(size, format, z)
+            )
+
+        db.execute(
+            'INSERT OR REPLACE INTO overviews VALUES (?,?,?)',
+            (size, format, sqlite3.Binary(buf.getvalue()))
+        )
+
+    db.commit()
+
+    return len(set(sizes))
+
+
+def get_overview(db, size, format=None):
+    """Get the smallest overview that is at least `size` pixels large, or the
+    largest one if none is, with a single lookup of the primary key.
+    Returns `(size, format, image)` or `None` if there are no overviews."""
+    query = (
+        'SELECT size, format, image FROM overviews '
+        'WHERE size {} ? {}'
+        'ORDER BY size {} LIMIT 1'
+    )
+    params = (size,) if format is None else (size, format)
+    format_clause = '' if format is None else 'AND format = ? '
+
+    try:
+        overview = db.execute(
+            query.format('>=', format_clause, 'ASC'), params
+        ).fetchone()
+
+        if overview is None:
+            overview = db.execute(
+                query.format('<', format_clause, 'DESC'), params
+            ).fetchone()
+    except sqlite3.OperationalError:
+        # The imtiles file has no overviews
+        return None
+
+    return overview
+
+
+def overviews(
+    imtiles_file, sizes=OVERVIEW_SIZES, format=None, verbose=False
+):
+    """(Re-)create the overviews of an existing imtiles file. Returns the
+    output file, the number of overviews, and the run time."""
+    start_time = time.time()
+
+    if not os.path.isfile(imtiles_file):
+        raise ImtilesError('Source file not found! ☹️')
+
+    db = sqlite3.connect(imtiles_file)
+
+    try:
+        num_overviews = create_overviews(db, sizes, format, verbose)
+    except sqlite3.DatabaseError:
+        raise ImtilesError(
+            '"{}" is not an imtiles file! 😵'.format(imtiles_file)
+        )
+    finally:
+        db.close()
+
+    return {
+        'output_file': imtiles_file,
+        'overviews': num_overviews,
+        'seconds': time.time() - start_time,
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        'file',
+        help='imtiles file to create the overviews of',
+        type=str
+    )
+
+    parser.add_argument(
+        '-s', '--sizes',
+        default=list(OVERVIEW_SIZES),
+        nargs='+',
+        help='sizes of the overviews in pixels of the longer side',
+        type=int
+    )
+
+    parser.add_argument(
+        '-f', '--format',
+        choices=OVERVIEW_FORMATS,
+        help=(
+            'image format of the overviews (defaults to jpg for jpg tiles and '
+            'png otherwise)'
+        ),
+        type=str
+    )
+
+    parser.add_argument(
+        '-v', '--verbose',
+        help='increase output verbosity',
+        action='store_true'
+    )
+
+
+def run(args):
+    return overviews(args.file, args.sizes, args.format, args.verbose)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        run(args)
+    except ImtilesError as e:
+        sys.exit(str(e))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import zlib
+
+from io import BytesIO
+
+# NumPy is imported by the functions that need it so that the tile data types
+# and colormaps can be looked up without loading it.
+
+# Tile data types that are stored as raw arrays instead of images. The source
+# tiles are `.npy` files and every tile is stored as a zlib compressed `.npy`
+# blob, which keeps its shape and byte order.
+RAW_DTYPES = {
+    'uint16': '<u2',
+    'float32': '<f4',
+}
+
+# Colormaps are defined by evenly spaced anchor colors (RGB) and linearly
+# interpolated into a lookup table of 256 RGBA colors
+COLORMAPS = {
+    # Same as the former `grey_to_rgb()`: 0 is white and 1 is black
+    'grey': [(255, 255, 255), (0, 0, 0)],
+    'fall': [
+        (255, 255, 255), (255, 255, 204), (255, 237, 160), (254, 217, 118),
+        (254, 178, 76), (253, 141, 60), (252, 78, 42), (227, 26, 28),
+        (189, 0, 38), (128, 0, 38), (0, 0, 0)
+    ],
+    'viridis': [
+        (68, 1, 84), (72, 40, 120), (62, 74, 137), (49, 104, 142),
+        (38, 130, 142), (31, 158, 137), (53, 183, 121), (110, 206, 88),
+        (181, 222, 43), (253, 231, 37)
+    ],
+}
+
+
+def is_raw_dtype(dtype):
+    return dtype in RAW_DTYPES
+
+
+def encode_raw_tile(arr, dtype):
+    import numpy as np
+
+    buf = BytesIO()
+    np.save(buf, np.asarray(arr).astype(RAW_DTYPES[dtype], copy=False))
+    return zlib.compress(buf.getvalue())
+
+
+def read_raw_tile(f, dtype):
+    """Read a `.npy` tile from a file object and encode it for storage."""
+    import numpy as np
+
+    return encode_raw_tile(np.load(BytesIO(f.read())), dtype)
+
+
+def get_raw_tile_file(blob):
+    """Get the `.npy` file of a stored tile, which `read_raw_tile()` reads."""
+    return zlib.decompress(blob)
+
+
+def decode_raw_tile(blob):
+    import numpy as np
+
+    return np.load(BytesIO(zlib.decompress(blob)))
+
+
+def get_colormap_lut(colormap='grey'):
+    """256 x 4 RGBA lookup table of a colormap as `uint8`."""
+    import numpy as np
+
+    anchors = np.array(COLORMAPS[colormap], dtype=np.float64)
+
+    lut = np.empty((256, 4), dtype=np.uint8)
+    lut[:, 3] = 255
+
+    pos = np.linspace(0, 1, len(anchors))
+    for channel in range(3):
+        lut[:, channel] = np.round(
+            np.interp(np.linspace(0, 1, 256), pos, anchors[:, channel])
+        )
+
+    return lut
+
+
+def apply_colormap(arr, lut, vmin=None, vmax=None):
+    """Map a 2D `uint16` or `float32` array to `uint8` RGBA colors.
+
+    Values are scaled linearly from `[vmin, vmax]` onto the 256 colors of
+    `lut`. `uint16` arrays are mapped through a precomputed table of all
+    65536 possible values so no float copy of the array is ever created.
+    Non-finite values become transparent.
+    """
+    import numpy as np
+
+    if arr.dtype == np.uint16:
+        vmin = 0 if vmin is None else vmin
+        vmax = 65535 if vmax is None else vmax
+        scale = 255 / max(vmax - vmin, 1e-12)
+        index = np.clip(
+            (np.arange(65536, dtype=np.float32) - vmin) * scale, 0, 255
+        ).astype(np.uint8)
+
+        return lut[index][arr]
+
+    vmin = 0 if vmin is None else vmin
+    vmax = 1 if vmax is None else vmax
+    scale = np.float32(255 / max(vmax - vmin, 1e-12))
+
+    index = np.subtract(arr, np.float32(vmin), dtype=np.float32)
+    index *= scale
+    finite = np.isfinite(index)
+    np.clip(index, 0, 255, out=index)
+    index[~finite] = 0
+
+    rgba = lut[index.astype(np.uint8)]
+    rgba[~finite, 3] = 0
+
+    return rgba
@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import sys
+import argparse
+import time
+import zlib
+
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from im2db import (
+    OVERVIEW_SIZES, ImtilesError, add_overview_arguments,
+    get_tile_file_extension, get_tile_grid, get_tile_rowid_sql, insert_tile,
+    read_tile, store_overviews
+)
+from rawtiles import decode_raw_tile, encode_raw_tile, is_raw_dtype
+
+# NumPy and Pillow are imported by the functions that need them, like in
+# `snapshots2db.py`.
+
+# Errors raised when a tile can't be decoded
+DECODE_ERRORS = (OSError, ValueError, zlib.error)
+
+# Number of tiles that are read at once to check them
+CHECK_CHUNK_SIZE = 1024
+
+# Formats of Pillow to encode synthesized image tiles in
+PIL_FORMATS = {
+    'jpg': 'JPEG',
+    'png': 'PNG',
+    'gif': 'GIF',
+}
+
+
+def decode_tile(blob, tile_size, im_type):
+    """Decode a tile into an array of `tile_size` x `tile_size` pixels. Tiles
+    at the border of the image, which can be smaller, are padded."""
+    import numpy as np
+
+    if is_raw_dtype(im_type):
+        arr = decode_raw_tile(blob)
+        fill = np.nan if arr.dtype.kind == 'f' else 0
+    else:
+        from PIL import Image
+
+        image = Image.open(BytesIO(blob))
+        arr = np.asarray(image.convert('RGB' if im_type == 'jpg' else 'RGBA'))
+        fill = 0
+
+    if arr.shape[:2] != (tile_size, tile_size):
+        padded = np.full(
+            (tile_size, tile_size) + arr.shape[2:], fill, dtype=arr.dtype
+        )
+        h = min(arr.shape[0], tile_size)
+        w = min(arr.shape[1], tile_size)
+        padded[:h, :w] = arr[:h, :w]
+        arr = padded
+
+    return arr
+
+
+def encode_tile(arr, im_type):
+    if is_raw_dtype(im_type):
+        return encode_raw_tile(arr, im_type)
+
+    from PIL import Image
+
+    buf = BytesIO()
+    Image.fromarray(arr).save(buf, format=PIL_FORMATS[im_type])
+    return buf.getvalue()
+
+
+def downsample_children(children, tile_size, im_type):
+    """Synthesize a tile from its (up to) four children given as a list of
+    `(dy, dx, blob)` by averaging blocks of 2 x 2 pixels."""
+    import numpy as np
+
+    arrs = [
+        (dy, dx, decode_tile(blob, tile_size, im_type))
+        for dy, dx, blob in children
+    ]
+    sample = arrs[0][2]
+
+    mosaic = np.full(
+        (2 * tile_size, 2 * tile_size) + sample.shape[2:],
+        np.nan if sample.dtype.kind == 'f' else 0,
+        dtype=np.float32
+    )
+    for dy, dx, arr in arrs:
+        mosaic[
+            dy * tile_size:(dy + 1) * tile_size,
+            dx * tile_size:(dx + 1) * tile_size
+        ] = arr
+
+    tile = mosaic.reshape(
+        (tile_size, 2, tile_size, 2) + sample.shape[2:]
+    ).mean(axis=(1, 3))
+
+    if sample.dtype.kind != 'f':
+        tile = np.round(tile)
+
+    return tile.astype(sample.dtype)
+
+
+def upsample_ancestor(ancestor, levels, dy, dx, tile_size, im_type):
+    """Synthesize a tile by cropping the part `(dy, dx)` of the
+    `2^levels` x `2^levels` parts of an ancestor `levels` zoom levels up and
+    scaling it up by a factor of `2^levels`."""
+    import numpy as np
+
+    arr = decode_tile(ancestor, tile_size, im_type)
+    pixels = np.arange(tile_size)
+    rows = (dy * tile_size + pixels) >> levels
+    cols = (dx * tile_size + pixels) >> levels
+
+    return arr[rows][:, cols]
+
+
+def synthesize_tile(job):
+    method, sources, tile_size, im_type = job
+
+    if method == 'children':
+        arr = downsample_children(sources, tile_size, im_type)
+    else:
+        arr = upsample_ancestor(*sources, tile_size, im_type)
+
+    return encode_tile(arr, im_type)
+
+
+def check_tile(job):
+    blob, tile_size, im_type = job
+
+    try:
+        decode_tile(blob, tile_size, im_type)
+    except DECODE_ERRORS:
+        return False
+
+    return True
+
+
+def get_tiles_layout(db):
+    """Guess the layout (see `im2db.TILE_LAYOUTS`) of an existing tiles
+    table so repaired tiles are stored the same way."""
+    (sql,) = db.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'tiles'"
+    ).fetchone()
+
+    if 'WITHOUT ROWID' in sql.upper():
+        return 'without-rowid'
+
+    max_zoom = db.execute('SELECT MAX(z) FROM tiles').fetchone()[0] or 0
+    num_other = db.execute(
+        'SELECT COUNT(*) FROM tiles WHERE rowid != {}'
+        .format(get_tile_rowid_sql(max_zoom))
+    ).fetchone()[0]
+
+    return 'raster' if num_other else 'morton'
+
+
+def get_missing_tiles(db, grid):
+    """Get the tiles of the grid that are missing in `db`. Only the positions
+    of one zoom level are held in memory at a time."""
+    missing = set()
+    for z, (wt, ht) in enumerate(grid):
+        present = set(
+            db.execute('SELECT y, x FROM tiles WHERE z = ?', (z,))
+        )
+        missing.update(
+            (z, y, x)
+            for y in range(ht)
+            for x in range(wt)
+            if (y, x) not in present
+        )
+
+    return missing
+
+
+def create_synthesized_table(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS synthesized_tiles
+        (
+            z INT NOT NULL,
+            y INT NOT NULL,
+            x INT NOT NULL,
+            method TEXT,
+            PRIMARY KEY (z, y, x)
+        )
+        ''')
+    db.commit()
+
+
+def repair_tiles(
+    db, tile_size, grid, im_type, layout='raster', check=False, workers=None,
+    verbose=False
+):
+    """Synthesize all tiles of the grid that are missing in `db`.
+
+    Missing tiles are downsampled from their children, starting at the
+    finest zoom level. Missing tiles without any existing tile below them are
+    cropped and upsampled from their nearest existing ancestor first, so that
+    the tiles above them can be downsampled from complete children. With
+    `check`, tiles that can't be decoded are replaced as well. Synthesized
+    tiles are recorded in the `synthesized_tiles` table. Returns the number
+    of synthesized tiles and raises `ImtilesError` if some tiles can't be
+    synthesized.
+    """
+    missing = get_missing_tiles(db, grid)
+
+    create_synthesized_table(db)
+
+    if not check and not missing:
+        # Nothing to do, so don't start any worker processes
+        return 0
+
+    with ProcessPoolExecutor(workers) as pool:
+        if check:
+            corrupted = []
+            cursor = db.execute('SELECT z, y, x, image FROM tiles')
+
+            # Decode the tiles in chunks so only one chunk is in memory
+            while True:
+                tiles = cursor.fetchmany(CHECK_CHUNK_SIZE)
+                if not tiles:
+                    break
+
+                valid = pool.map(
+                    check_tile,
+                    [(image, tile_size, im_type) for _, _, _, image in tiles],
+                    chunksize=64
+                )
+                corrupted.extend(
+                    (z, y, x)
+                    for (z, y, x, _), is_valid in zip(tiles, valid)
+                    if not is_valid
+                )
+
+            for z, y, x in corrupted:
+                if verbose:
+                    print('Corrupted tile {}.{}.{}'.format(z, y, x))
+                db.execute(
+                    'DELETE FROM tiles WHERE z = ? AND y = ? AND x = ?',
+                    (z, y, x)
+                )
+                missing.add((z, y, x))
+
+        def get_tile(z, y, x):
+            return db.execute(
+                'SELECT image FROM tiles WHERE z = ? AND y = ? AND x = ?',
+                (z, y, x)
+            ).fetchone()[0]
+
+        def get_children(z, y, x):
+            wt, ht = grid[z + 1]
+            return [
+                (dy, dx, 2 * y + dy, 2 * x + dx)
+                for dy in (0, 1) for dx in (0, 1)
+                if 2 * y + dy < ht and 2 * x + dx < wt
+            ]
+
+        def synthesize(tiles, jobs):
+            try:
+                images = list(pool.map(synthesize_tile, jobs))
+            except DECODE_ERRORS:
+                raise ImtilesError(
+                    'Neighbouring tiles are corrupted! 😵  Please check all '
+                    'tiles with `repair.py --check`.'
+                )
+
+            for (z, y, x), (method, *_), image in zip(tiles, jobs, images):
+                if verbose:
+                    print(
+                        'Synthesize {}.{}.{} from its {}'
+                        .format(z, y, x, method)
+                    )
+
+                insert_tile(db, z, y, x, image, layout, replace=True)
+                db.execute(
+                    'INSERT OR REPLACE INTO synthesized_tiles '
+                    'VALUES (?,?,?,?)',
+                    (z, y, x, method)
+                )
+                missing.discard((z, y, x))
+
+            db.commit()
+
+        def from_children(z):
+            tiles = sorted(
+                (tz, y, x) for tz, y, x in missing
+                if tz == z and not any(
+                    (z + 1, cy, cx) in missing
+                    for _, _, cy, cx in get_children(z, y, x)
+                )
+            )
+
+            jobs = [
+                (
+                    'children',
+                    [
+                        (dy, dx, get_tile(z + 1, cy, cx))
+                        for dy, dx, cy, cx in get_children(z, y, x)
+                    ],
+                    tile_size,
+                    im_type
+                )
+                for _, y, x in tiles
+            ]
+            synthesize(tiles, jobs)
+
+            return len(tiles)
+
+        def has_tiles_below(z, y, x, memo):
+            if z + 1 >= len(grid):
+                return False
+
+            if (z, y, x) not in memo:
+                memo[(z, y, x)] = any(
+                    (z + 1, cy, cx) not in missing or
+                    has_tiles_below(z + 1, cy, cx, memo)
+                    for _, _, cy, cx in get_children(z, y, x)
+                )
+
+            return memo[(z, y, x)]
+
+        def from_ancestors():
+            # Only tiles that can't be downsampled, however many zoom levels
+            # down, so no tile is upsampled from a part of an ancestor that
+            # had to be synthesized without any data
+            memo = {}
+            tiles = []
+            jobs = []
+            for z, y, x in sorted(missing):
+                if has_tiles_below(z, y, x, memo):
+                    continue
+
+                for levels in range(1, z + 1):
+                    ancestor = (z - levels, y >> levels, x >> levels)
+                    if ancestor not in missing:
+                        break
+                else:
+                    continue
+
+                mask = (1 << levels) - 1
+                tiles.append((z, y, x))
+                jobs.append((
+                    'parent' if levels == 1 else 'ancestor',
+                    (get_tile(*ancestor), levels, y & mask, x & mask),
+                    tile_size,
+                    im_type
+                ))
+
+            synthesize(tiles, jobs)
+
+            return len(tiles)
+
+        num_missing = len(missing)
+
+        while missing:
+            num_synthesized = 0
+
+            # Bottom-up, so a tile can be synthesized from synthesized
+            # children, and then from the ancestors for the tiles that can't
+            for z in range(len(grid) - 2, -1, -1):
+                num_synthesized += from_children(z)
+
+            num_synthesized += from_ancestors()
+
+            if not num_synthesized:
+                break
+
+    if missing:
+        raise ImtilesError(
+            '{} tiles could not be synthesized! 😵  Tile set is corrupted.'
+            .format(len(missing))
+        )
+
+    return num_missing
+
+
+def replace_synthesized_tiles(db, source_dir, im_type, layout, verbose=False):
+    """Replace synthesized tiles with the real ones once they are found in
+    `source_dir`. Returns the number of replaced tiles."""
+    num_replaced = 0
+
+    for z, y, x in db.execute(
+        'SELECT z, y, x FROM synthesized_tiles'
+    ).fetchall():
+        file_path = os.path.join(
+            source_dir, 'tiles',
+            '{}.{}.{}.{}'.format(z, y, x, get_tile_file_extension(im_type))
+        )
+
+        if not os.path.isfile(file_path):
+            continue
+
+        if verbose:
+            print('Replace {}'.format(file_path))
+
+        with open(file_path, 'rb') as f:
+            insert_tile(db, z, y, x, read_tile(f, im_type), layout, True)
+
+        db.execute(
+            'DELETE FROM synthesized_tiles WHERE z = ? AND y = ? AND x = ?',
+            (z, y, x)
+        )
+        num_replaced += 1
+
+    db.commit()
+
+    return num_replaced
+
+
+def repair(
+    imtiles_file, replace_from=None, check=False, workers=None, verbose=False,
+    overview_sizes=OVERVIEW_SIZES, overview_format=None
+):
+    """Synthesize missing (and with `check` corrupted) tiles of an imtiles
+    file in place. With `replace_from`, synthesized tiles are first replaced
+    by the real tiles found in that directory. If any tile changed, the
+    overviews are rendered again. Returns the output file, the number of
+    replaced and synthesized tiles, and the run time."""
+    start_time = time.time()
+
+    if not os.path.isfile(imtiles_file):
+        raise ImtilesError('Source file not found! ☹️')
+
+    db = sqlite3.connect(imtiles_file)
+
+    try:
+        tile_size, max_zoom, width, height, dtype = db.execute(
+            'SELECT tile_size, max_zoom, width, height, dtype '
+            'FROM tileset_info'
+        ).fetchone()
+
+        if db.execute(
+            "SELECT name FROM sqlite_master WHERE name = 'partition_info'"
+        ).fetchone():
+            raise ImtilesError(
+                'Partial databases can\'t be repaired! 😬  Please repair '
+                'the merged file.'
+            )
+
+        layout = get_tiles_layout(db)
+        create_synthesized_table(db)
+
+        num_replaced = 0
+        if replace_from:
+            num_replaced = replace_synthesized_tiles(
+                db, replace_from, dtype, layout, verbose
+            )
+
+        num_synthesized = repair_tiles(
+            db, tile_size, get_tile_grid(tile_size, max_zoom, width, height),
+            dtype, layout, check, workers, verbose
+        )
+
+        if num_replaced or num_synthesized:
+            store_overviews(db, overview_sizes, overview_format, verbose)
+    finally:
+        db.close()
+
+    return {
+        'output_file': imtiles_file,
+        'replaced': num_replaced,
+        'synthesized': num_synthesized,
+        'seconds': time.time() - start_time,
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        'file',
+        help='imtiles file to be repaired in place',
+        type=str
+    )
+
+    parser.add_argument(
+        '-r', '--replace-from',
+        help=(
+            'directory of image tiles to replace previously synthesized '
+            'tiles with'
+        ),
+        type=str
+    )
+
+    parser.add_argument(
+        '-c', '--check',
+        default=False,
+        action='store_true',
+        help='decode every tile and replace the ones that are corrupted'
+    )
+
+    parser.add_argument(
+        '-j', '--workers',
+        help='number of worker processes (defaults to the number of CPUs)',
+        type=int
+    )
+
+    add_overview_arguments(parser)
+
+    parser.add_argument(
+        '-v', '--verbose',
+        help='increase output verbosity',
+        action='store_true'
+    )
+
+
+def run(args):
+    return repair(
+        args.file, args.replace_from, args.check, args.workers, args.verbose,
+        args.overview_sizes, args.overview_format
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        run(args)
+    except ImtilesError as e:
+        sys.exit(str(e))
+
+if __name__ == '__main__':
+    main()
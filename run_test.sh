@@ -5,3 +5,82 @@ rm -rf test/out
 
 ./im2db.py test/54825 -o test/54825.imtiles -v
 ./test.py test/54825.imtiles -o test/out -v
+
+rm -f test/54825.impack test/54825.unpacked.imtiles
+
+./db2pack.py test/54825.imtiles -o test/54825.impack
+./db2pack.py test/54825.impack -r -o test/54825.unpacked.imtiles
+
+# Repair two missing tiles at adjacent zoom levels. The finer one has to be
+# upsampled from real data of an ancestor, not from an empty quadrant.
+rm -rf test/54825.missing test/54825.missing.imtiles
+cp -r test/54825 test/54825.missing
+rm test/54825.missing/tiles/2.0.1.jpg test/54825.missing/tiles/1.0.0.jpg
+
+./im2db.py test/54825.missing -o test/54825.missing.imtiles --repair || exit 1
+
+python3 - <<'PYTHON' || exit 1
+import sqlite3
+import sys
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+db = sqlite3.connect('test/54825.missing.imtiles')
+(image,) = db.execute(
+    'SELECT image FROM tiles WHERE z = 2 AND y = 0 AND x = 1'
+).fetchone()
+repaired = np.asarray(Image.open(BytesIO(image)), dtype=np.float32)
+
+with open('test/54825/tiles/2.0.1.jpg', 'rb') as f:
+    original = np.asarray(Image.open(f), dtype=np.float32)
+
+if abs(repaired.mean() - original.mean()) > 10:
+    sys.exit('Repaired tile 2.0.1 differs from the original')
+PYTHON
+
+rm -rf test/54825.missing test/54825.missing.imtiles
+
+# Round trip of a raw float32 tile set through export and ingest
+rm -rf test/54825.raw test/54825.raw.imtiles test/54825.reraw.imtiles
+rm -rf test/out-raw
+
+python3 - <<'PYTHON' || exit 1
+import os
+import shutil
+
+import numpy as np
+from PIL import Image
+
+os.makedirs('test/54825.raw/tiles')
+shutil.copy('test/54825/info.json', 'test/54825.raw/info.json')
+
+for file_name in os.listdir('test/54825/tiles'):
+    im = Image.open(os.path.join('test/54825/tiles', file_name))
+    np.save(
+        os.path.join(
+            'test/54825.raw/tiles', file_name.replace('.jpg', '.npy')
+        ),
+        np.asarray(im.convert('L'), dtype=np.float32) / 255
+    )
+PYTHON
+
+./im2db.py test/54825.raw -t float32 -o test/54825.raw.imtiles || exit 1
+./db2tiles.py test/54825.raw.imtiles -o test/out-raw || exit 1
+./im2db.py test/out-raw/54825 -t float32 -o test/54825.reraw.imtiles || exit 1
+
+python3 - <<'PYTHON' || exit 1
+import sqlite3
+import sys
+
+query = 'SELECT z, y, x, image FROM tiles ORDER BY z, y, x'
+original = sqlite3.connect('test/54825.raw.imtiles').execute(query)
+reingested = sqlite3.connect('test/54825.reraw.imtiles').execute(query)
+
+if original.fetchall() != reingested.fetchall():
+    sys.exit('Re-ingested raw tiles differ from the original')
+PYTHON
+
+rm -rf test/54825.raw test/54825.raw.imtiles test/54825.reraw.imtiles
+rm -rf test/out-raw
@@ -4,55 +4,121 @@ import argparse
 import collections as col
 import json
 import math
-import numpy as np
 import os
-import slugid
 import sqlite3
 import struct
 import sys
+import time
 import zlib
 
 from io import BytesIO
-from PIL import Image
+from im2db import ImtilesError
+from rawtiles import (
+    COLORMAPS, apply_colormap, decode_raw_tile, get_colormap_lut,
+    is_raw_dtype
+)
+
+# NumPy, Pillow, and slugid are imported by the functions that need them, so
+# importing this module and building databases without pre-fetching stays
+# fast.
 
 
 def grey_to_rgb(arr, to_rgba=False):
-    if to_rgba:
-        rgb = np.zeros(arr.shape + (4,))
-        rgb[:, :, 3] = 255
-    else:
-        rgb = np.zeros(arr.shape + (3,))
+    import numpy as np
+
+    rgba = apply_colormap(
+        arr.astype(np.float32, copy=False), get_colormap_lut('grey'), 0, 1
+    )
+
+    return rgba if to_rgba else rgba[:, :, :3]
+
+
+def hilbert_index(n, x, y):
+    """Position of `(x, y)` along the Hilbert curve filling an `n` x `n` grid.
+    `n` must be a power of 2."""
+    d = 0
+    s = n // 2
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+
+        # Rotate the quadrant
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - x
+                y = s - 1 - y
+            x, y = y, x
+
+        s //= 2
+
+    return d
+
+
+class TileCache:
+    """Least recently used cache of decoded image tiles keyed by `(z, y, x)`
+    that keeps track of its hit rate."""
+
+    def __init__(self, max_tiles):
+        self.max_tiles = max_tiles
+        self.tiles = col.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        tile = self.tiles.get(key)
+
+        if tile is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.tiles.move_to_end(key)
+
+        return tile
+
+    def put(self, key, tile):
+        if self.max_tiles <= 0:
+            return
+
+        self.tiles[key] = tile
+        self.tiles.move_to_end(key)
 
-    rgb[:, :, 0] = 255 - arr * 255
-    rgb[:, :, 1] = rgb[:,:,0]
-    rgb[:, :, 2] = rgb[:,:,0]
+        while len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
 
-    return rgb
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'requests': requests,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+        }
 
 
 def is_within(start1, end1, start2, end2, width, height):
     return start1 < width and end1 > 0 and start2 < height and end2 > 0
 
 
-def np_to_png(arr, comp=9):
-    sz = arr.shape
+def to_rgba(arr):
+    import numpy as np
+
+    if arr.shape[2] == 4:
+        return arr.astype(np.uint8, copy=False)
 
     # Add alpha values
-    if arr.shape[2] == 3:
-        out = np.ones(
-            (sz[0], sz[1], sz[2] + 1)
-        )
-        out[:, :, 3] = 255
-        out[:, :, 0:3] = arr
-    else:
-        out = arr
-
-    return write_png(
-        np.flipud(out).astype('uint8').flatten('C').tobytes(),
-        sz[1],
-        sz[0],
-        comp
-    )
+    out = np.empty(arr.shape[:2] + (4,), dtype=np.uint8)
+    out[:, :, 3] = 255
+    out[:, :, 0:3] = arr
+
+    return out
+
+
+def np_to_png(arr, comp=9):
+    buf = BytesIO()
+    write_png_strips(buf, arr.shape[1], arr.shape[0], [to_rgba(arr)], comp)
+
+    return buf.getvalue()
 
 
 def png_pack(png_tag, data):
@@ -62,77 +128,162 @@ def png_pack(png_tag, data):
             struct.pack("!I", 0xFFFFFFFF & zlib.crc32(chunk_head)))
 
 
-def write_png(buf, width, height, comp=9):
-    """ buf: must be bytes or a bytearray in Python3.x,
-        a regular string in Python2.x.
-    """
+def write_png_strips(f, width, height, strips, comp=9):
+    """Write an RGBA PNG to the file object `f` from an iterable of horizontal
+    `uint8` strips (height x `width` x 4), which together are `height` pixels
+    high. Each strip is compressed and written as soon as it is received, so
+    only one strip has to be held in memory."""
+    import numpy as np
+
+    f.write(b'\x89PNG\r\n\x1a\n')
+    f.write(png_pack(
+        b'IHDR', struct.pack("!2I5B", width, height, 8, 6, 0, 0, 0)
+    ))
+
+    compressor = zlib.compressobj(comp)
+
+    for strip in strips:
+        # Every scanline starts with a filter type byte (0: none). The
+        # scanlines are compressed straight from the array's buffer.
+        h = strip.shape[0]
+        scanlines = np.hstack((
+            np.zeros((h, 1), dtype=np.uint8),
+            strip.reshape(h, width * 4)
+        ))
+
+        data = compressor.compress(scanlines)
+        if data:
+            f.write(png_pack(b'IDAT', data))
+
+    f.write(png_pack(b'IDAT', compressor.flush()))
+    f.write(png_pack(b'IEND', b''))
+
 
-    # reverse the vertical line order and add null bytes at the start
-    width_byte_4 = width * 4
-    raw_data = b''.join(
-        b'\x00' + buf[span:span + width_byte_4]
-        for span in np.arange((height - 1) * width_byte_4, -1, - width_byte_4)
-    )
-
-    return b''.join([
-        b'\x89PNG\r\n\x1a\n',
-        png_pack(b'IHDR', struct.pack("!2I5B", width, height, 8, 6, 0, 0, 0)),
-        png_pack(b'IDAT', zlib.compress(raw_data, comp)),
-        png_pack(b'IEND', b'')])
-
-
-def get_snippet_from_image_tiles(
-    tiles,
-    tile_size,
-    tiles_x_range,
-    tiles_y_range,
-    tile_start1_id,
-    tile_start2_id,
-    from_x,
-    to_x,
-    from_y,
-    to_y
+def render_raw_tile(blob, lut, vmin=None, vmax=None):
+    """Colormap a raw data tile into an RGBA image."""
+    from PIL import Image
+
+    return Image.fromarray(
+        apply_colormap(decode_raw_tile(blob), lut, vmin, vmax), 'RGBA'
+    )
+
+
+def get_rgba_tile(db, z, y, x, lut=None, value_range=(None, None)):
+    """Decode a tile into an RGBA array. Raw data tiles are colormapped with
+    `lut`. Returns `None` for missing tiles."""
+    import numpy as np
+    from PIL import Image
+
+    image = db.execute(
+        'SELECT image FROM tiles WHERE z=? AND y=? AND x=?', (z, y, x)
+    ).fetchone()
+
+    if image is None:
+        return None
+
+    if lut is None:
+        return np.asarray(Image.open(BytesIO(image[0])).convert('RGBA'))
+
+    return apply_colormap(decode_raw_tile(image[0]), lut, *value_range)
+
+
+def iter_region_strips(
+    db, z, x_from, x_to, y_from, y_to, tile_size=256, tile_cache=None,
+    lut=None, value_range=(None, None)
 ):
-    im = (
-        tiles[0]
-        if len(tiles) == 1
-        else Image.new(
-            'RGB',
-            (tile_size * len(tiles_x_range), tile_size * len(tiles_y_range))
+    """Yield the pixels `[x_from, x_to) x [y_from, y_to)` of zoom level `z`
+    as RGBA strips, one per row of tiles. Missing tiles are transparent."""
+    import numpy as np
+
+    for ty in range(y_from // tile_size, (y_to - 1) // tile_size + 1):
+        strip_from = max(y_from, ty * tile_size)
+        strip_to = min(y_to, (ty + 1) * tile_size)
+
+        strip = np.zeros(
+            (strip_to - strip_from, x_to - x_from, 4), dtype=np.uint8
         )
+
+        for tx in range(x_from // tile_size, (x_to - 1) // tile_size + 1):
+            tile = None
+            if tile_cache is not None:
+                tile = tile_cache.get((z, ty, tx))
+
+            if tile is None:
+                tile = get_rgba_tile(db, z, ty, tx, lut, value_range)
+
+                if tile is not None and tile_cache is not None:
+                    tile_cache.put((z, ty, tx), tile)
+
+            if tile is None:
+                continue
+
+            # Part of the tile (which can be smaller at the image's border)
+            # within the strip
+            col_from = max(x_from, tx * tile_size)
+            col_to = min(x_to, tx * tile_size + tile.shape[1])
+            row_to = min(strip_to, ty * tile_size + tile.shape[0])
+
+            if col_from >= col_to or strip_from >= row_to:
+                continue
+
+            strip[
+                :row_to - strip_from, col_from - x_from:col_to - x_from
+            ] = tile[
+                strip_from - ty * tile_size:row_to - ty * tile_size,
+                col_from - tx * tile_size:col_to - tx * tile_size,
+                :4
+            ]
+
+        yield strip
+
+
+def render_region_png(
+    db, z, x_from, x_to, y_from, y_to, f=None, tile_size=256,
+    tile_cache=None, colormap='grey', value_range=(None, None), comp=9
+):
+    """Render the pixels `[x_from, x_to) x [y_from, y_to)` of zoom level `z`
+    to a PNG in strips of one row of tiles, so memory is bounded by one strip
+    regardless of the size of the region. The PNG is written to the file
+    object `f` or returned if `f` is `None`."""
+    dtype = db.execute('SELECT dtype FROM tileset_info').fetchone()[0]
+    lut = get_colormap_lut(colormap) if is_raw_dtype(dtype) else None
+
+    out = BytesIO() if f is None else f
+
+    write_png_strips(
+        out,
+        x_to - x_from,
+        y_to - y_from,
+        iter_region_strips(
+            db, z, x_from, x_to, y_from, y_to, tile_size, tile_cache, lut,
+            value_range
+        ),
+        comp
     )
 
-    # Stitch them tiles together
-    if len(tiles) > 1:
-        i = 0
-        for y in range(len(tiles_y_range)):
-            for x in range(len(tiles_x_range)):
-                im.paste(tiles[i], (x * tile_size, y * tile_size))
-                i += 1
+    if f is None:
+        return out.getvalue()
+
 
-    # Convert starts and ends to local tile ids
-    start1_rel = from_x - tile_start1_id * tile_size
-    end1_rel = to_x - tile_start1_id * tile_size
-    start2_rel = from_y - tile_start2_id * tile_size
-    end2_rel = to_y - tile_start2_id * tile_size
+def get_tile_png(db, z, y, x, colormap='grey', vmin=None, vmax=None):
+    """Get a tile as an image. Raw data tiles are colormapped and returned as
+    PNG while image tiles are returned as they are stored."""
+    import numpy as np
 
-    # Ensure that the cropped image is at least 1x1 pixel otherwise the image
-    # is not returned as a numpy array but the Pillow object... (odd bug)
-    x_diff = end1_rel - start1_rel
-    y_diff = end2_rel - start2_rel
+    dtype = db.execute('SELECT dtype FROM tileset_info').fetchone()[0]
+    image = db.execute(
+        'SELECT image FROM tiles WHERE z=? AND y=? AND x=?', (z, y, x)
+    ).fetchone()
 
-    if x_diff < 1.0:
-        x_center = start1_rel + (x_diff / 2)
-        start1_rel = x_center - 0.5
-        end1_rel = x_center + 0.5
+    if image is None:
+        return None
 
-    if y_diff < 1.0:
-        y_center = start1_rel + (y_diff / 2)
-        start2_rel = y_center - 0.5
-        end2_rel = y_center + 0.5
+    if not is_raw_dtype(dtype):
+        return image[0]
 
-    # Notice the shape: height x width x channel
-    return np.array(im.crop((start1_rel, start2_rel, end1_rel, end2_rel)))
+    return np_to_png(np.asarray(
+        render_raw_tile(image[0], get_colormap_lut(colormap), vmin, vmax)
+    ))
 
 
 def get_images(
@@ -146,8 +297,15 @@ def get_images(
     zoom_to=math.inf,
     padding=0,
     tile_size=256,
-    max_size=512
+    max_size=512,
+    tile_cache=None,
+    colormap='grey',
+    value_range=(None, None)
 ):
+    """Render the region of an annotation as PNG for every zoom level from
+    `zoom_from` to `zoom_to`. Regions that are larger than `max_size` pixels
+    are skipped unless `max_size` is `None`; the rendering itself only holds
+    one row of tiles in memory."""
     div = 1
     width = 0
     height = 0
@@ -172,7 +330,7 @@ def get_images(
             ims.append(None)
             continue
 
-        if (
+        if max_size is not None and (
             x2 - x1 > max_size or
             y2 - y1 > max_size
         ):
@@ -180,38 +338,22 @@ def get_images(
             ims.append(None)
             continue
 
-        # Get tile ids
-        tile_start1_id = int(x1 // tile_size)
-        tile_end1_id = int(x2 // tile_size)
-        tile_start2_id = int(y1 // tile_size)
-        tile_end2_id = int(y2 // tile_size)
-
-        tiles_x_range = range(tile_start1_id, tile_end1_id + 1)
-        tiles_y_range = range(tile_start2_id, tile_end2_id + 1)
-
-        # Extract image tiles
-        tiles = []
-        for y in tiles_y_range:
-            for x in tiles_x_range:
-                tiles.append(Image.open(BytesIO(db.execute(
-                    'SELECT image FROM tiles WHERE z=? AND y=? AND x=?',
-                    (zoom_level, y, x)
-                ).fetchone()[0])))
-
-        im_snip = get_snippet_from_image_tiles(
-            tiles,
-            tile_size,
-            tiles_x_range,
-            tiles_y_range,
-            tile_start1_id,
-            tile_start2_id,
-            x1,
-            x2,
-            y1,
-            y2
-        )
-
-        ims.append((zoom_level, np_to_png(im_snip)))
+        # Same rounding as cropping with Pillow, but at least 1 x 1 pixel
+        px_from = round(x1)
+        px_to = max(round(x2), px_from + 1)
+        py_from = round(y1)
+        py_to = max(round(y2), py_from + 1)
+
+        ims.append((
+            zoom_level,
+            render_region_png(
+                db, zoom_level, px_from, px_to, py_from, py_to,
+                tile_size=tile_size,
+                tile_cache=tile_cache,
+                colormap=colormap,
+                value_range=value_range
+            )
+        ))
 
     return ims
 
@@ -255,9 +397,37 @@ def store_meta_data(
     pass
 
 
-def create_img_cache(db):
+def create_intervals(db):
     db.execute('''
-        CREATE TABLE images
+        CREATE TABLE intervals
+        (
+            id int PRIMARY KEY,
+            zoomLevel int,
+            importance real,
+            fromX int,
+            toX int,
+            fromY int,
+            toY int,
+            chrOffset int,
+            uid text,
+            fields text
+        )''')
+
+    db.execute('''
+        CREATE VIRTUAL TABLE position_index USING rtree(
+            id,
+            rFromX, rToX,
+            rFromY, rToY
+        )''')
+    db.commit()
+
+
+def create_img_cache(db, cache_size=None):
+    """Create the image cache tables. Tables of existing databases, possibly
+    created by earlier versions without the book keeping tables, are kept
+    and completed."""
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS images
         (
             id int NOT NULL,
             z INT NOT NULL,
@@ -265,9 +435,75 @@ def create_img_cache(db):
             PRIMARY KEY (id, z)
         )
         ''')
+
+    # Book keeping for `get_preview()`: the size and last access time of every
+    # cached image and the byte budget of the cache (`NULL` means unbounded)
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS images_access
+        (
+            id int NOT NULL,
+            z INT NOT NULL,
+            size INT NOT NULL,
+            accessed REAL NOT NULL,
+            PRIMARY KEY (id, z)
+        )
+        ''')
+    db.execute(
+        'CREATE INDEX IF NOT EXISTS images_access_accessed '
+        'ON images_access (accessed)'
+    )
+    db.execute('CREATE TABLE IF NOT EXISTS images_info (cache_size INT)')
+
+    # Previews that were cached without book keeping count as least recently
+    # accessed
+    db.execute(
+        'INSERT OR IGNORE INTO images_access '
+        'SELECT id, z, LENGTH(image), 0 FROM images'
+    )
+
+    if db.execute('SELECT COUNT(*) FROM images_info').fetchone()[0] == 0:
+        db.execute('INSERT INTO images_info VALUES (?)', (cache_size,))
+
     db.commit()
 
 
+def save_img(db, id, z, image):
+    db.execute(
+        'INSERT OR REPLACE INTO images VALUES (?,?,?)',
+        (id, z, sqlite3.Binary(image))
+    )
+    db.execute(
+        'INSERT OR REPLACE INTO images_access VALUES (?,?,?,?)',
+        (id, z, len(image), time.time())
+    )
+
+
+def evict_imgs(db, cache_size, keep=None):
+    """Remove the least recently accessed images until the cached images fit
+    into `cache_size` bytes. The image `keep`, given as `(id, z)`, is never
+    removed."""
+    total = db.execute(
+        'SELECT COALESCE(SUM(size), 0) FROM images_access'
+    ).fetchone()[0]
+
+    if total <= cache_size:
+        return
+
+    evicted = []
+    for id, z, size in db.execute(
+        'SELECT id, z, size FROM images_access ORDER BY accessed'
+    ):
+        if total <= cache_size:
+            break
+        if (id, z) == keep:
+            continue
+        evicted.append((id, z))
+        total -= size
+
+    db.executemany('DELETE FROM images WHERE id=? AND z=?', evicted)
+    db.executemany('DELETE FROM images_access WHERE id=? AND z=?', evicted)
+
+
 def pre_fetch_and_save_img(
     db,
     imtiles_db,
@@ -280,9 +516,10 @@ def pre_fetch_and_save_img(
     zoom_from,
     zoom_to,
     max_size,
+    tile_cache=None,
+    colormap='grey',
+    value_range=(None, None),
 ):
-    query_insert_image = 'INSERT INTO images VALUES (?,?,?)'
-
     images = get_images(
         imtiles_db,
         imtiles_info,
@@ -292,39 +529,185 @@ def pre_fetch_and_save_img(
         y_to,
         zoom_from=zoom_from,
         zoom_to=zoom_to,
-        max_size=max_size
+        max_size=max_size,
+        tile_cache=tile_cache,
+        colormap=colormap,
+        value_range=value_range
     )
 
     for image in images:
         if image is not None:
-            db.execute(
-                query_insert_image,
-                (id, image[0], sqlite3.Binary(image[1]))
-            )
+            save_img(db, id, image[0], image[1])
             db.commit()
 
 
+def get_preview(
+    db,
+    imtiles_db,
+    imtiles_info,
+    id,
+    z,
+    max_size=512,
+    cache_size=None,
+    colormap='grey',
+    value_range=(None, None)
+):
+    """Get the PNG preview of annotation `id` at zoom level `z`.
+
+    Previews are rendered from the image tiles on first request and stored in
+    the `images` table. Once the cached previews exceed `cache_size` bytes
+    (by default the size the cache was created with) the least recently used
+    previews are evicted. Returns `None` if no preview can be rendered.
+    Raises `ImtilesError` if `db` isn't a snapshots database.
+    """
+    tables = set(
+        name for (name,) in
+        db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    )
+
+    if 'intervals' not in tables:
+        raise ImtilesError('Database is not a snapshots database! 😵')
+
+    if 'images_info' not in tables:
+        # Built without pre-fetching or by an earlier version
+        create_img_cache(db, cache_size)
+
+    image = db.execute(
+        'SELECT image FROM images WHERE id=? AND z=?', (id, z)
+    ).fetchone()
+
+    if image is not None:
+        db.execute(
+            'UPDATE images_access SET accessed=? WHERE id=? AND z=?',
+            (time.time(), id, z)
+        )
+        db.commit()
+        return image[0]
+
+    bbox = db.execute(
+        'SELECT fromX, toX, fromY, toY FROM intervals WHERE id=?', (id,)
+    ).fetchone()
+
+    if bbox is None or z < 0 or z > imtiles_info['max_zoom']:
+        return None
+
+    images = get_images(
+        imtiles_db,
+        imtiles_info,
+        *bbox,
+        zoom_from=z,
+        zoom_to=z,
+        max_size=max_size,
+        colormap=colormap,
+        value_range=value_range
+    )
+
+    if images[0] is None:
+        return None
+
+    image = images[0][1]
+
+    save_img(db, id, z, image)
+
+    if cache_size is None:
+        cache_size = db.execute(
+            'SELECT cache_size FROM images_info'
+        ).fetchone()[0]
+
+    if cache_size is not None:
+        evict_imgs(db, cache_size, keep=(id, z))
+
+    db.commit()
+
+    return image
+
+
+def get_tile_id_ranges(x_min, x_max, y_min, y_max, z, tile_size, max_zoom):
+    """Ranges of the tile IDs along x and y that an annotation covers at zoom
+    level `z` when counting annotations per tile."""
+    tile_width = tile_size * 2 ** (max_zoom - z)
+
+    return (
+        range(
+            math.floor(x_min / tile_width), math.ceil(x_max / tile_width) + 1
+        ),
+        range(
+            math.floor(y_min / tile_width), math.ceil(y_max / tile_width) + 1
+        ),
+    )
+
+
+def load_annotations(db, info):
+    """Rebuild the annotation counts per tile and collect the Gigapan IDs of
+    the snapshots of an existing database. Returns the tile counts, the IDs,
+    and the next free annotation ID."""
+    tile_counts = col.defaultdict(
+        lambda: col.defaultdict(lambda: col.defaultdict(int))
+    )
+    snapshot_ids = set()
+
+    for z, x_min, x_max, y_min, y_max, fields in db.execute(
+        'SELECT zoomLevel, fromX, toX, fromY, toY, fields FROM intervals'
+    ):
+        x_range, y_range = get_tile_id_ranges(
+            x_min, x_max, y_min, y_max, z,
+            info['tile_size'], info['max_zoom']
+        )
+        for i in x_range:
+            for j in y_range:
+                tile_counts[z][i][j] += 1
+
+        snapshot_ids.add(json.loads(fields)['id'])
+
+    counter = db.execute(
+        'SELECT COALESCE(MAX(id), -1) + 1 FROM intervals'
+    ).fetchone()[0]
+
+    return tile_counts, snapshot_ids, counter
+
+
 def snapshots_to_db(
     snapshots_path,
-    output_file,
-    tileset_info,
-    max_per_tile,
-    pre_fetch,
-    pre_fetch_zoom_from,
-    pre_fetch_zoom_to,
-    pre_fetch_max_size,
-    from_x,
-    to_x,
-    from_y,
-    to_y,
-    xlim_rel,
-    ylim_rel,
-    limit_excl,
-    overwrite,
-    verbose
+    output_file=None,
+    tileset_info='info.json',
+    max_per_tile=25,
+    pre_fetch=None,
+    pre_fetch_zoom_from=0,
+    pre_fetch_zoom_to=math.inf,
+    pre_fetch_max_size=512,
+    pre_fetch_lazy=False,
+    pre_fetch_cache_size=None,
+    pre_fetch_order='views',
+    pre_fetch_tile_cache=256,
+    colormap='grey',
+    value_range=(None, None),
+    from_x=-math.inf,
+    to_x=math.inf,
+    from_y=-math.inf,
+    to_y=math.inf,
+    xlim_rel=False,
+    ylim_rel=False,
+    limit_excl=False,
+    overwrite=False,
+    verbose=False,
+    append=False
 ):
+    """Convert Gigapan snapshots into a BEDPE-like SQLite database.
+
+    With `append`, the snapshots are added to an existing database: snapshots
+    that are already stored are skipped, new ones are placed around the
+    existing annotations, and only new annotations are pre-fetched.
+
+    Returns the output file, the number of snapshots and new annotations,
+    pre-fetching statistics, and the run time. Raises `ImtilesError` if the
+    snapshots can't be converted.
+    """
+    import slugid
+
+    start_time = time.time()
+
     if not os.path.isfile(snapshots_path):
-        sys.exit('Snapshots file not found! ☹️')
+        raise ImtilesError('Snapshots file not found! ☹️')
 
     # Read snapshots
     with open(snapshots_path, 'r') as f:
@@ -338,20 +721,30 @@ def snapshots_to_db(
         if not os.path.isfile(tileset_info):
             tileset_info = os.path.join(base_dir, 'info.json')
             if not os.path.isfile(tileset_info):
-                sys.exit('Tile set info file not found! 😫')
+                raise ImtilesError('Tile set info file not found! 😫')
             print('Info: using default tile set info file. 🤓')
 
     if not output_file:
         output_file = '{}.multires.db'.format(base_dir)
 
-    if os.path.isfile(output_file):
+    if append and overwrite:
+        raise ImtilesError('Either append to or overwrite the output! 🤔')
+
+    if pre_fetch_lazy and not pre_fetch:
+        raise ImtilesError(
+            'Lazy pre-fetching needs an imtiles file to pre-fetch from! 🤔'
+        )
+
+    append = append and os.path.isfile(output_file)
+
+    if os.path.isfile(output_file) and not append:
         if overwrite:
             try:
                 os.remove(output_file)
             except OSError:
                 pass
         else:
-            sys.exit(
+            raise ImtilesError(
                 'Output exists already! 😬  Please check and remove it if ' +
                 'necessary.'
             )
@@ -361,10 +754,10 @@ def snapshots_to_db(
         info = json.load(f)
 
     if not info:
-        sys.exit('Tile set info broken! 😤')
+        raise ImtilesError('Tile set info broken! 😤')
 
-    assert(from_x < to_x)
-    assert(from_y < to_y)
+    if from_x >= to_x or from_y >= to_y:
+        raise ImtilesError('Limits are empty! 🤷')
 
     if from_x > -math.inf and xlim_rel:
         from_x = info['max_width'] * from_x
@@ -383,53 +776,79 @@ def snapshots_to_db(
     # sqlite3.register_adapter(np.int64, lambda val: int(val))
     db = sqlite3.connect(output_file)
 
-    store_meta_data(
-        db, 1, -1, None, None, None,
-        info['tile_size'], info['max_zoom'],
-        info['tile_size'] * (2 ** info['max_zoom']),
-        info['max_width'], info['max_height']
-    )
+    if not append:
+        store_meta_data(
+            db, 1, -1, None, None, None,
+            info['tile_size'], info['max_zoom'],
+            info['tile_size'] * (2 ** info['max_zoom']),
+            info['max_width'], info['max_height']
+        )
 
-    db.execute('''
-        CREATE TABLE intervals
-        (
-            id int PRIMARY KEY,
-            zoomLevel int,
-            importance real,
-            fromX int,
-            toX int,
-            fromY int,
-            toY int,
-            chrOffset int,
-            uid text,
-            fields text
-        )''')
+        create_intervals(db)
+
+    try:
+        stored_info = db.execute(
+            'SELECT tile_size, max_zoom, width, height FROM tileset_info'
+        ).fetchone()
+        tile_counts, snapshot_ids, counter = load_annotations(db, info)
+    except sqlite3.DatabaseError:
+        db.close()
+        raise ImtilesError(
+            '"{}" is not a snapshots database! 😵'.format(output_file)
+        )
 
-    db.execute('''
-        CREATE VIRTUAL TABLE position_index USING rtree(
-            id,
-            rFromX, rToX,
-            rFromY, rToY
-        )''')
+    if stored_info != (
+        info['tile_size'], info['max_zoom'],
+        info['max_width'], info['max_height']
+    ):
+        db.close()
+        raise ImtilesError(
+            'Snapshots database is from a different tile set! 😤'
+        )
 
     if pre_fetch:
         if not os.path.isfile(pre_fetch):
             pre_fetch = os.path.join(base_dir, pre_fetch)
             if not os.path.isfile(pre_fetch):
-                sys.exit('Imtiles for pre-fretching is not a file! 💩')
+                db.close()
+                if not append:
+                    os.remove(output_file)
+                raise ImtilesError(
+                    'Imtiles for pre-fretching is not a file! 💩'
+                )
 
         tileset = sqlite3.connect(pre_fetch)
-        create_img_cache(db)
 
-    counter = 0
-    tile_counts = col.defaultdict(
-        lambda: col.defaultdict(lambda: col.defaultdict(int))
-    )
+        try:
+            tileset.execute('SELECT max_zoom FROM tileset_info').fetchone()
+        except sqlite3.DatabaseError:
+            tileset.close()
+            db.close()
+            if not append:
+                os.remove(output_file)
+            raise ImtilesError(
+                '"{}" is not an imtiles file! 😵'.format(pre_fetch)
+            )
+
+        # Before any annotation is stored, so that an append never leaves
+        # annotations behind whose previews couldn't be stored
+        create_img_cache(db, pre_fetch_cache_size)
+
+    first_annotation = counter
+    num_skipped = 0
     pre_fetched = set()
+    pre_fetch_queue = []
+    tile_cache = TileCache(pre_fetch_tile_cache)
 
     # Convert snapshots to dict
     for snapshot in snapshots:
         snapshot = snapshot['snapshot']
+
+        if snapshot['id'] in snapshot_ids:
+            # Skip because it's already in the database
+            num_skipped += 1
+            continue
+
         snapshot['xmin'] = math.floor(snapshot['xmin'])
         snapshot['xmax'] = math.ceil(snapshot['xmax'])
         snapshot['ymin'] = math.floor(snapshot['ymin'])
@@ -457,22 +876,21 @@ def snapshots_to_db(
             continue
 
         for z in range(info['max_zoom'] + 1):
-            tile_width = info['tile_size'] * 2 ** (info['max_zoom'] - z)
-
             # Tile IDs (not tiles)
-            tile_id_start_x = math.floor(snapshot['xmin'] / tile_width)
-            tile_id_end_x = math.ceil(snapshot['xmax'] / tile_width)
-            tile_id_start_y = math.floor(snapshot['ymin'] / tile_width)
-            tile_id_end_y = math.ceil(snapshot['ymax'] / tile_width)
+            x_range, y_range = get_tile_id_ranges(
+                snapshot['xmin'], snapshot['xmax'],
+                snapshot['ymin'], snapshot['ymax'],
+                z, info['tile_size'], info['max_zoom']
+            )
 
             tile_is_full = False
 
             # check if any of the tiles at this zoom level are full
-            for i in range(tile_id_start_x, tile_id_end_x + 1):
+            for i in x_range:
                 if tile_is_full:
                     continue
 
-                for j in range(tile_id_start_y, tile_id_end_y + 1):
+                for j in y_range:
                     if tile_counts[z][i][j] > max_per_tile:
 
                         tile_is_full = True
@@ -480,8 +898,8 @@ def snapshots_to_db(
 
             if not tile_is_full:
                 # they're all not full yet so add this interval
-                for i in range(tile_id_start_x, tile_id_end_x + 1):
-                    for j in range(tile_id_start_y, tile_id_end_y + 1):
+                for i in x_range:
+                    for j in y_range:
                         tile_counts[z][i][j] += 1
 
                 annotation = (
@@ -519,27 +937,99 @@ def snapshots_to_db(
                 )
                 db.commit()
 
-                if pre_fetch and tileset and counter not in pre_fetched:
-                    pre_fetch_and_save_img(
-                        db,
-                        tileset,
-                        info,
+                if (
+                    pre_fetch and
+                    tileset and
+                    not pre_fetch_lazy and
+                    counter not in pre_fetched
+                ):
+                    pre_fetch_queue.append((
                         counter,
                         snapshot['xmin'], snapshot['xmax'],
-                        snapshot['ymin'], snapshot['ymax'],
-                        max(pre_fetch_zoom_from, 0),
-                        min(pre_fetch_zoom_to, info['max_zoom']),
-                        pre_fetch_max_size
-                    )
+                        snapshot['ymin'], snapshot['ymax']
+                    ))
                     pre_fetched.add(counter)
 
+                    if pre_fetch_order == 'views':
+                        pre_fetch_and_save_img(
+                            db,
+                            tileset,
+                            info,
+                            *pre_fetch_queue.pop(),
+                            max(pre_fetch_zoom_from, 0),
+                            min(pre_fetch_zoom_to, info['max_zoom']),
+                            pre_fetch_max_size,
+                            tile_cache,
+                            colormap,
+                            value_range
+                        )
+
                 counter += 1
                 break
 
+    if pre_fetch_order == 'hilbert' and pre_fetch_queue:
+        # Render the previews in the order of their bounding box centers
+        # along a Hilbert curve so that consecutive previews share tiles
+        n = info['tile_size'] * (2 ** info['max_zoom'])
+        # The curve needs a power of 2, which tile sizes don't have to be
+        n = 1 << (n - 1).bit_length()
+
+        def hilbert_key(annotation):
+            _, x_from, x_to, y_from, y_to = annotation
+            return hilbert_index(
+                n,
+                min(max(int((x_from + x_to) / 2), 0), n - 1),
+                min(max(int((y_from + y_to) / 2), 0), n - 1)
+            )
 
-def main():
-    parser = argparse.ArgumentParser()
+        for annotation in sorted(pre_fetch_queue, key=hilbert_key):
+            pre_fetch_and_save_img(
+                db,
+                tileset,
+                info,
+                *annotation,
+                max(pre_fetch_zoom_from, 0),
+                min(pre_fetch_zoom_to, info['max_zoom']),
+                pre_fetch_max_size,
+                tile_cache,
+                colormap,
+                value_range
+            )
+
+    if pre_fetched:
+        stats = tile_cache.stats()
+        print(
+            'Info: pre-fetched {} annotations in {} order. Tile cache: '
+            '{} requests, {} hits, {} misses ({:.1%} hit rate). 📈'.format(
+                len(pre_fetched),
+                pre_fetch_order,
+                stats['requests'],
+                stats['hits'],
+                stats['misses'],
+                stats['hit_rate']
+            )
+        )
+
+    num_images = 0
+    if pre_fetch:
+        num_images = db.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+        tileset.close()
+
+    db.close()
+
+    return {
+        'output_file': output_file,
+        'snapshots': len(snapshots),
+        'annotations': counter - first_annotation,
+        'skipped': num_skipped,
+        'pre_fetched': len(pre_fetched),
+        'images': num_images,
+        'tile_cache': tile_cache.stats(),
+        'seconds': time.time() - start_time,
+    }
 
+
+def add_arguments(parser):
     parser.add_argument(
         'file',
         help='snapshots file to be converted',
@@ -593,6 +1083,63 @@ def main():
         type=int
     )
 
+    parser.add_argument(
+        '--pre-fetch-lazy',
+        default=False,
+        action='store_true',
+        help=(
+            'only create the image cache and render previews on first request '
+            'via `get_preview()`'
+        ),
+    )
+
+    parser.add_argument(
+        '--pre-fetch-cache-size',
+        help=(
+            'max number of bytes of cached previews after which the least '
+            'recently used ones are evicted by `get_preview()`'
+        ),
+        type=int
+    )
+
+    parser.add_argument(
+        '--pre-fetch-order',
+        default='views',
+        choices=['views', 'hilbert'],
+        help=(
+            'order in which previews are rendered: by views or along a '
+            'Hilbert curve of the annotation positions for better tile reuse'
+        ),
+        type=str
+    )
+
+    parser.add_argument(
+        '--pre-fetch-tile-cache',
+        default=256,
+        help='number of decoded image tiles cached while pre-fetching',
+        type=int
+    )
+
+    parser.add_argument(
+        '--colormap',
+        default='grey',
+        choices=sorted(COLORMAPS),
+        help='colormap for pre-fetching raw data (uint16 or float32) tiles',
+        type=str
+    )
+
+    parser.add_argument(
+        '--value-range',
+        default=(None, None),
+        nargs=2,
+        metavar=('MIN', 'MAX'),
+        help=(
+            'values mapped onto the first and last color of the colormap '
+            '(defaults to 0 to 65535 for uint16 and 0 to 1 for float32)'
+        ),
+        type=float
+    )
+
     parser.add_argument(
         '--from-x',
         default=-math.inf,
@@ -651,6 +1198,16 @@ def main():
         ),
     )
 
+    parser.add_argument(
+        '-a', '--append',
+        default=False,
+        action='store_true',
+        help=(
+            'add new snapshots to an existing output and skip the ones that '
+            'are stored already'
+        )
+    )
+
     parser.add_argument(
         '-w', '--overwrite',
         default=False,
@@ -666,9 +1223,9 @@ def main():
         action='store_true'
     )
 
-    args = parser.parse_args()
 
-    snapshots_to_db(
+def run(args):
+    return snapshots_to_db(
         args.file,
         args.output,
         args.info,
@@ -677,6 +1234,12 @@ def main():
         args.pre_fetch_zoom_from,
         args.pre_fetch_zoom_to,
         args.pre_fetch_max_size,
+        args.pre_fetch_lazy,
+        args.pre_fetch_cache_size,
+        args.pre_fetch_order,
+        args.pre_fetch_tile_cache,
+        args.colormap,
+        tuple(args.value_range),
         args.from_x,
         args.to_x,
         args.from_y,
@@ -685,8 +1248,20 @@ def main():
         args.ylim_rel,
         args.limit_excl,
         args.overwrite,
-        args.verbose
+        args.verbose,
+        args.append
     )
 
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        run(args)
+    except ImtilesError as e:
+        sys.exit(str(e))
+
 if __name__ == '__main__':
     main()
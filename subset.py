@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+import os
+import math
+import sqlite3
+import sys
+import argparse
+import time
+
+from im2db import (
+    OVERVIEW_SIZES, TILE_LAYOUTS, ImtilesError, add_overview_arguments,
+    create_tiles_table, get_insert_tiles_query, store_meta_data,
+    store_overviews
+)
+
+
+def subset(
+    source,
+    output_file=None,
+    from_x=0,
+    to_x=math.inf,
+    from_y=0,
+    to_y=math.inf,
+    zoom_from=0,
+    zoom_to=math.inf,
+    layout='raster',
+    overwrite=False,
+    verbose=False,
+    overview_sizes=OVERVIEW_SIZES,
+    overview_format=None
+):
+    """Copy the tiles of a bounding box and zoom range into a new imtiles
+    file and render its overviews.
+
+    The subset is a tile set of its own. Its zoom level 0 is the finest zoom
+    level up to `zoom_from` at which the bounding box fits into one tile, so
+    coarser zoom levels than `zoom_from` are copied if needed. This tile
+    becomes the origin of the subset.
+
+    Returns the output file, the number of copied tiles, the origin of the
+    subset (in pixels at the max zoom level of the source), the zoom level
+    of the source that became zoom level 0, and the run time. Raises
+    `ImtilesError` if the subset can't be extracted.
+    """
+    start_time = time.time()
+
+    if not os.path.isfile(source):
+        raise ImtilesError('Source file not found! ☹️')
+
+    if not output_file:
+        output_file = '{}.subset.imtiles'.format(os.path.splitext(source)[0])
+
+    if os.path.isfile(output_file):
+        if overwrite:
+            try:
+                os.remove(output_file)
+            except OSError:
+                pass
+        else:
+            raise ImtilesError(
+                'Output exists already! 😬  Please check and remove it if ' +
+                'necessary.'
+            )
+
+    db = sqlite3.connect(output_file)
+
+    try:
+        db.execute('ATTACH DATABASE ? AS source', (source,))
+
+        (
+            zoom_step, max_length, assembly, chrom_names, chrom_sizes,
+            tile_size, max_zoom, width, height, dtype
+        ) = db.execute(
+            'SELECT zoom_step, max_length, assembly, chrom_names, '
+            'chrom_sizes, tile_size, max_zoom, width, height, dtype '
+            'FROM source.tileset_info'
+        ).fetchone()
+    except sqlite3.DatabaseError:
+        db.close()
+        os.remove(output_file)
+        raise ImtilesError('"{}" is not an imtiles file! 😵'.format(source))
+
+    from_x = max(from_x, 0)
+    from_y = max(from_y, 0)
+    to_x = min(to_x, width)
+    to_y = min(to_y, height)
+    zoom_from = max(zoom_from, 0)
+    zoom_to = min(zoom_to, max_zoom)
+
+    if from_x >= to_x or from_y >= to_y or zoom_from > zoom_to:
+        db.close()
+        os.remove(output_file)
+        raise ImtilesError('The subset is empty! 🤷')
+
+    def get_tile_range(start, end, z):
+        tile_width = tile_size * 2 ** (max_zoom - z)
+        return math.floor(start / tile_width), math.ceil(end / tile_width) - 1
+
+    # Start the subset at a single tile, so its tiles line up with the tiles
+    # of the source at every zoom level and zoom level 0 has one tile
+    zoom_offset = zoom_from
+    while zoom_offset > 0 and any(
+        tile_from != tile_to
+        for tile_from, tile_to in (
+            get_tile_range(from_x, to_x, zoom_offset),
+            get_tile_range(from_y, to_y, zoom_offset)
+        )
+    ):
+        zoom_offset -= 1
+
+    origin_width = tile_size * 2 ** (max_zoom - zoom_offset)
+    origin_x = math.floor(from_x / origin_width) * origin_width
+    origin_y = math.floor(from_y / origin_width) * origin_width
+
+    # Tile ranges per zoom level from the origin to the end of the bounding
+    # box
+    bounds = []
+    for z in range(zoom_offset, zoom_to + 1):
+        tile_width = tile_size * 2 ** (max_zoom - z)
+        bounds.append((
+            z,
+            origin_y // tile_width,
+            get_tile_range(from_y, to_y, z)[1],
+            origin_x // tile_width,
+            get_tile_range(from_x, to_x, z)[1],
+        ))
+
+    if verbose:
+        print('Origin of the subset: x {}, y {}'.format(origin_x, origin_y))
+
+        for z, y_from, y_to, x_from, x_to in bounds:
+            print(
+                'Copy zoom level {} as {}: y {}-{}, x {}-{}'
+                .format(z, z - zoom_offset, y_from, y_to, x_from, x_to)
+            )
+
+    # The extent of the subset at its max zoom level, `zoom_to`
+    div = 2 ** (max_zoom - zoom_to)
+    subset_max_zoom = zoom_to - zoom_offset
+
+    try:
+        store_meta_data(
+            db, zoom_step, max_length, assembly, chrom_names, chrom_sizes,
+            tile_size, subset_max_zoom, tile_size * 2 ** subset_max_zoom,
+            int(math.ceil(to_x / div)) - origin_x // div,
+            int(math.ceil(to_y / div)) - origin_y // div,
+            dtype
+        )
+
+        create_tiles_table(db, layout)
+
+        db.execute(
+            'CREATE TEMPORARY TABLE bounds '
+            '(z INT, y_from INT, y_to INT, x_from INT, x_to INT)'
+        )
+        db.executemany('INSERT INTO temp.bounds VALUES (?,?,?,?,?)', bounds)
+
+        # Copy all tiles in one statement so the tiles never pass through
+        # Python. The ranges start at the origin, so they also rebase the
+        # tiles.
+        cursor = db.execute(get_insert_tiles_query(
+            '''
+            SELECT
+                t.z - {} AS z,
+                t.y - b.y_from AS y,
+                t.x - b.x_from AS x,
+                t.image AS image
+            FROM temp.bounds AS b
+            JOIN source.tiles AS t
+            ON t.z = b.z
+            AND t.y BETWEEN b.y_from AND b.y_to
+            AND t.x BETWEEN b.x_from AND b.x_to
+            ORDER BY t.z, t.y, t.x
+            '''.format(zoom_offset),
+            layout,
+            subset_max_zoom
+        ))
+    except sqlite3.DatabaseError as e:
+        db.close()
+        os.remove(output_file)
+        raise ImtilesError('Extracting the subset failed! 😵  {}'.format(e))
+
+    if verbose:
+        print('Copied {} tiles'.format(cursor.rowcount))
+
+    db.commit()
+    db.execute('DETACH DATABASE source')
+
+    store_overviews(db, overview_sizes, overview_format, verbose)
+    db.close()
+
+    return {
+        'output_file': output_file,
+        'tiles': cursor.rowcount,
+        'origin': (origin_x, origin_y),
+        'zoom_offset': zoom_offset,
+        'seconds': time.time() - start_time,
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        'file',
+        help='imtiles file to extract the subset from',
+        type=str
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        help='name of the sqlite database to be generated',
+        type=str
+    )
+
+    parser.add_argument(
+        '--from-x',
+        default=0,
+        help='start x position (in pixel at the max zoom level)',
+        type=float
+    )
+
+    parser.add_argument(
+        '--to-x',
+        default=math.inf,
+        help='end x position (in pixel at the max zoom level)',
+        type=float
+    )
+
+    parser.add_argument(
+        '--from-y',
+        default=0,
+        help='start y position (in pixel at the max zoom level)',
+        type=float
+    )
+
+    parser.add_argument(
+        '--to-y',
+        default=math.inf,
+        help='end y position (in pixel at the max zoom level)',
+        type=float
+    )
+
+    parser.add_argument(
+        '--zoom-from',
+        default=0,
+        help='first zoom level to be included',
+        type=int
+    )
+
+    parser.add_argument(
+        '--zoom-to',
+        default=math.inf,
+        help='last zoom level to be included',
+        type=int
+    )
+
+    parser.add_argument(
+        '-l', '--layout',
+        default='raster',
+        choices=TILE_LAYOUTS,
+        help='physical layout of the tiles table',
+        type=str
+    )
+
+    parser.add_argument(
+        '-w', '--overwrite',
+        default=False,
+        action='store_true',
+        help='overwrite output if exist'
+    )
+
+    add_overview_arguments(parser)
+
+    parser.add_argument(
+        '-v', '--verbose',
+        help='increase output verbosity',
+        action='store_true'
+    )
+
+
+def run(args):
+    return subset(
+        args.file,
+        args.output,
+        args.from_x,
+        args.to_x,
+        args.from_y,
+        args.to_y,
+        args.zoom_from,
+        args.zoom_to,
+        args.layout,
+        args.overwrite,
+        args.verbose,
+        args.overview_sizes,
+        args.overview_format
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        run(args)
+    except ImtilesError as e:
+        sys.exit(str(e))
+
+if __name__ == '__main__':
+    main()